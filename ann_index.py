@@ -0,0 +1,173 @@
+import os
+import json
+import numpy as np
+import scipy.sparse as sp
+from dotenv import load_dotenv
+from retrieval import TopKRetriever
+
+# Load environment variables
+load_dotenv()
+ANN_DIMENSIONS = int(os.getenv("ANN_DIMENSIONS", "128"))  # LSA embedding size
+ANN_LISTS = int(os.getenv("ANN_LISTS", "0"))  # k-means cells, 0 picks ~sqrt(catalog size)
+ANN_PROBES = int(os.getenv("ANN_PROBES", "8"))  # Cells scanned per query (raised until ANN_TARGET_RECALL is met)
+ANN_RERANK = int(os.getenv("ANN_RERANK", "200"))  # Shortlist re-scored with exact sparse cosine
+ANN_TRAIN_SAMPLE = int(os.getenv("ANN_TRAIN_SAMPLE", "100000"))  # Rows used to fit the SVD and k-means
+
+
+class IvfAnnIndex:
+    """Approximate top-k: LSA (TruncatedSVD) embeddings in an inverted file of k-means cells.
+
+    A query scans the `n_probe` closest cells, keeps the best `rerank` rows by embedding score and
+    re-scores only those against the sparse TF-IDF rows, so `match_score` keeps its exact meaning.
+    """
+
+    def __init__(self, dimensions=ANN_DIMENSIONS, n_lists=ANN_LISTS, n_probe=ANN_PROBES, rerank=ANN_RERANK):
+        self.dimensions = dimensions
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.rerank = rerank
+        self.recall = None  # Measured recall@k against the exact path, set by `calibrate`
+        self.features = None  # Hashed feature ids seen in training; the projection only covers these
+        self.components = None  # (dimensions, len(features)) float32
+        self.centroids = None  # (n_lists, dimensions) float32, L2-normalized
+        self.embeddings = None  # (rows, dimensions) float32, L2-normalized
+        self.assignments = None  # Cell of every row
+        self.order = None  # Rows grouped by cell...
+        self.offsets = None  # ...cell `c` is order[offsets[c]:offsets[c + 1]]
+
+    def build(self, matrix, sample_size=ANN_TRAIN_SAMPLE, seed=0):
+        """Fits the projection and cells on a row sample, then embeds and assigns every row."""
+        # Deferred: scikit-learn is slow to import and only needed once an index is built or queried
+        from sklearn.cluster import MiniBatchKMeans
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.preprocessing import normalize
+
+        n = matrix.shape[0]
+        rng = np.random.default_rng(seed)
+        sample = matrix[np.sort(rng.choice(n, sample_size, replace=False))] if n > sample_size else matrix
+
+        # Dense components over all 2**20 hashed features would be huge; keep the columns in use
+        self.features = np.flatnonzero(np.bincount(sample.indices, minlength=matrix.shape[1])).astype(np.int64)
+        dimensions = max(1, min(self.dimensions, sample.shape[0] - 1, len(self.features) - 1))
+        svd = TruncatedSVD(n_components=dimensions, algorithm="randomized", random_state=seed)
+        svd.fit(sample[:, self.features])
+        self.components = svd.components_.astype(np.float32)
+
+        n_lists = self.n_lists or int(np.sqrt(n))
+        n_lists = max(1, min(n_lists, sample.shape[0]))
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, batch_size=4096, n_init=3, random_state=seed)
+        kmeans.fit(self._embed(sample))
+        self.centroids = normalize(kmeans.cluster_centers_).astype(np.float32)
+
+        self.embeddings = self._embed(matrix)
+        self.assignments = self._assign(self.embeddings)
+        self._group()
+        return self
+
+    def extend(self, rows):
+        """A new index with `rows` appended, reusing the fitted projection and cells.
+
+        Returns a copy so a query holding the old index never sees half-updated arrays.
+        """
+        extended = IvfAnnIndex(self.dimensions, self.n_lists, self.n_probe, self.rerank)
+        extended.recall = self.recall
+        extended.features, extended.components, extended.centroids = self.features, self.components, self.centroids
+        embeddings = self._embed(rows)
+        extended.embeddings = np.vstack([self.embeddings, embeddings])
+        extended.assignments = np.concatenate([self.assignments, self._assign(embeddings)])
+        extended._group()
+        return extended
+
+    def top_k(self, query_vector, matrix, ratings, popularity, k=10, n_probe=None, rows=None):
+        """Same contract as `TopKRetriever.top_k`, scanning only the closest cells.
+
+        `rows` (sorted catalog rows from `FilterIndex.candidates`) drops other rows from those cells
+        before the short list is taken.
+        """
+        query = self._embed(query_vector)[0]
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        cells = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        candidates = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in cells])
+        if rows is not None:
+            candidates = candidates[np.isin(candidates, rows)]
+        if len(candidates) == 0:
+            return []
+
+        if len(candidates) > self.rerank:
+            approximate = self.embeddings[candidates] @ query
+            candidates = candidates[np.argpartition(-approximate, self.rerank - 1)[:self.rerank]]
+        candidates.sort()  # Row slicing a CSR matrix is cheaper in order
+
+        exact = np.asarray((matrix[candidates] @ query_vector.T).todense()).ravel()
+        top = TopKRetriever.select(exact, ratings[candidates], popularity[candidates], k)
+        return [(int(candidates[row]), score) for row, score in top]
+
+    def calibrate(self, queries, matrix, ratings, popularity, target_recall, k=10):
+        """Raises `n_probe`, then `rerank`, until recall@k against exact retrieval reaches `target_recall`.
+
+        `queries` is a CSR matrix of query vectors; returns the measured recall.
+        """
+        exact = TopKRetriever(k)
+        truth = [{row for row, _ in exact.top_k(queries[i], matrix, ratings, popularity)}
+                 for i in range(queries.shape[0])]
+        truth = [(i, rows) for i, rows in enumerate(truth) if rows]
+
+        self.n_probe = min(max(1, self.n_probe), len(self.centroids))
+        while True:
+            found = sum(len(rows & {row for row, _ in self.top_k(queries[i], matrix, ratings, popularity, k)})
+                        for i, rows in truth)
+            self.recall = found / max(1, sum(len(rows) for _, rows in truth))
+            if self.recall >= target_recall:
+                break
+            if self.n_probe < len(self.centroids):
+                self.n_probe = min(self.n_probe * 2, len(self.centroids))
+            elif self.rerank < len(self.embeddings):
+                self.rerank *= 2  # Every cell is scanned; the embedding shortlist is what loses matches
+            else:
+                break
+        return self.recall
+
+    def save(self, path):
+        """Writes the projection, cells and row embeddings as .npy files next to the TF-IDF index."""
+        for name in ("features", "components", "centroids", "embeddings", "assignments"):
+            np.save(f"{path}/ann_{name}.npy", getattr(self, name))
+        with open(f"{path}/ann.json", "w") as f:
+            json.dump({"dimensions": self.dimensions, "n_lists": self.n_lists, "n_probe": self.n_probe,
+                       "rerank": self.rerank, "recall": self.recall}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Loads a saved ANN index, or returns None if the artifact was saved without one."""
+        try:
+            with open(f"{path}/ann.json") as f:
+                meta = json.load(f)
+        except OSError:
+            return None
+
+        index = cls(meta["dimensions"], meta["n_lists"], meta["n_probe"], meta["rerank"])
+        index.recall = meta["recall"]
+        for name in ("features", "components", "centroids", "embeddings", "assignments"):
+            setattr(index, name, np.load(f"{path}/ann_{name}.npy", mmap_mode=mmap_mode))
+        index._group()
+        return index
+
+    def _embed(self, rows):
+        from sklearn.preprocessing import normalize
+
+        # Keep only trained feature columns, project, and re-normalize for cosine scoring
+        rows = rows.tocsr()
+        positions = np.minimum(np.searchsorted(self.features, rows.indices), len(self.features) - 1)
+        known = self.features[positions] == rows.indices
+        compact = sp.csr_matrix((np.where(known, rows.data, 0).astype(np.float32), positions, rows.indptr),
+                                shape=(rows.shape[0], len(self.features)))
+        return normalize(np.asarray(compact @ self.components.T, dtype=np.float32), copy=False)
+
+    def _assign(self, embeddings):
+        cells = np.empty(len(embeddings), dtype=np.int32)
+        for start in range(0, len(embeddings), 10000):
+            cells[start:start + 10000] = np.argmax(embeddings[start:start + 10000] @ self.centroids.T, axis=1)
+        return cells
+
+    def _group(self):
+        self.order = np.argsort(self.assignments, kind="stable")
+        self.offsets = np.searchsorted(self.assignments[self.order], np.arange(len(self.centroids) + 1))
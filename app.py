@@ -1,8 +1,61 @@
+import os
+import threading
 from flask import Flask
+from db_handler import db
+from movie_recommender import recommender
 from routes import routes  # ✅ Importing 'routes' object from the Routes class
 
-app = Flask(__name__)
-app.register_blueprint(routes)  # ✅ Registering Blueprint
+
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+_warmed_up = False
+
+
+def warmup(schedule_rebuilds=False):
+    """Connects to MongoDB, loads (or trains) the index and starts the scoring processes.
+
+    Runs before traffic instead of inside the first request; `/ready` reports 200 once it's done.
+    If it fails, the next request that needs the index tries again.
+    """
+    global _warmed_up
+    try:
+        db.load()
+        recommender.load()
+        recommender.start_scoring_pool()
+        if schedule_rebuilds:
+            recommender.start_rebuild_scheduler()
+        _warmed_up = True
+        print(f"✅ Warmup finished: {len(recommender.movies)} movies indexed")
+    except Exception as e:
+        print(f"❌ Warmup failed: {e}")
+
+
+def start_warmup(schedule_rebuilds=False):
+    """Runs `warmup` in a background thread, unless it already succeeded or is still running."""
+    global _warmup_thread
+    if _warmed_up:
+        return
+    with _warmup_lock:
+        if not _warmed_up and (_warmup_thread is None or not _warmup_thread.is_alive()):
+            _warmup_thread = threading.Thread(target=warmup, args=(schedule_rebuilds,), name="warmup", daemon=True)
+            _warmup_thread.start()
+
+
+def create_app(warmup_in_background=True, schedule_rebuilds=False):
+    """Application factory. Importing this module connects to nothing; warmup happens here or on first request."""
+    app = Flask(__name__)
+    app.register_blueprint(routes)  # ✅ Registering Blueprint
+    if warmup_in_background:
+        start_warmup(schedule_rebuilds)
+    else:
+        # The first request (usually the `/ready` probe) starts it; a failed warmup is retried by the next one
+        app.before_request(lambda: start_warmup(schedule_rebuilds))
+    return app
+
+
+app = create_app(warmup_in_background=False, schedule_rebuilds=True)  # For `app:app` WSGI servers
+
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    # The debug reloader runs this twice; only the serving child (WERKZEUG_RUN_MAIN) warms up
+    create_app(warmup_in_background=os.environ.get("WERKZEUG_RUN_MAIN") == "true").run(debug=True)
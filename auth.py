@@ -1,17 +1,36 @@
 import jwt
+import time
 import datetime
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from flask import request, jsonify
 from functools import wraps
 from dotenv import load_dotenv
 from db_handler import db
+from metrics import metrics
+from result_cache import LocalCacheBackend
 
 # Load environment variables from .env
 load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "default_secret_key")  # Fallback if .env is missing
+AUTH_USER_CACHE_TTL = int(os.getenv("AUTH_USER_CACHE_TTL", "60"))  # Seconds a looked-up user is reused
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+LOGIN_WORKERS = int(os.getenv("LOGIN_WORKERS", "2"))  # Threads allowed to run bcrypt at once
+LOGIN_MAX_QUEUED = int(os.getenv("LOGIN_MAX_QUEUED", "16"))  # Logins waiting beyond this get a 503
+LOGIN_TIMEOUT = float(os.getenv("LOGIN_TIMEOUT", "10"))
+LOGIN_MAX_ATTEMPTS = int(os.getenv("LOGIN_MAX_ATTEMPTS", "5"))  # Per username, within the window below
+LOGIN_ATTEMPT_WINDOW = int(os.getenv("LOGIN_ATTEMPT_WINDOW", "300"))
 
 
 class AuthHandler:
+    def __init__(self):
+        self.user_cache = LocalCacheBackend(max_size=AUTH_USER_CACHE_SIZE)
+        self.login_attempts = LocalCacheBackend(max_size=AUTH_USER_CACHE_SIZE)  # username -> [timestamps]
+        self.attempts_lock = threading.Lock()
+        self.login_executor = ThreadPoolExecutor(max_workers=LOGIN_WORKERS, thread_name_prefix="bcrypt")
+        self.login_slots = threading.BoundedSemaphore(LOGIN_WORKERS + LOGIN_MAX_QUEUED)
+
     def generate_token(self, username):
         """Generate JWT token for authenticated users"""
         payload = {
@@ -30,10 +49,53 @@ class AuthHandler:
         except jwt.InvalidTokenError:
             return None  # Invalid token
 
+    def get_user(self, username):
+        """Returns the user (without password), served from a short-TTL cache when possible."""
+        user = self.user_cache.get(username)
+        if user is None:
+            user = db.users_collection.find_one({"username": username}, {"_id": 0, "password": 0})
+            if not user:
+                return None  # Unknown users are never cached
+            self.user_cache.set(username, user, ex=AUTH_USER_CACHE_TTL)
+        return dict(user)  # Callers may modify their copy
+
+    def invalidate_user(self, username):
+        """Drops a cached user, e.g. after a profile update."""
+        self.user_cache.delete(username)
+
     def authenticate_user(self, username, password):
-        """Mock authentication function (Replace with DB check)"""
-        users = {"admin": "password"}  # Replace with DB lookup
-        return username if username in users and users[username] == password else None
+        """Checks credentials on the bounded bcrypt pool.
+
+        Returns `(user, None)` on success, `(None, None)` for bad credentials and
+        `(None, (message, status))` when the login is throttled.
+        """
+        if not self._record_attempt(username):
+            return None, ("Too many login attempts! Try again later.", 429)
+
+        # ✅ Bound the work queued for bcrypt so a login spike can't starve the other workers
+        if not self.login_slots.acquire(blocking=False):
+            return None, ("Login service is busy! Try again shortly.", 503)
+        future = self.login_executor.submit(db.authenticate_user, username, password)
+        future.add_done_callback(lambda _: self.login_slots.release())  # Held until bcrypt really finishes
+        try:
+            user = future.result(timeout=LOGIN_TIMEOUT)
+        except FutureTimeoutError:
+            return None, ("Login timed out! Try again shortly.", 503)
+
+        if user:
+            self.login_attempts.delete(username)
+        return user, None
+
+    def _record_attempt(self, username):
+        """Counts a login attempt; False once the username is over its limit for the window."""
+        now = time.monotonic()
+        with self.attempts_lock:
+            attempts = [t for t in self.login_attempts.get(username) or [] if now - t < LOGIN_ATTEMPT_WINDOW]
+            if len(attempts) >= LOGIN_MAX_ATTEMPTS:
+                return False
+            attempts.append(now)
+            self.login_attempts.set(username, attempts, ex=LOGIN_ATTEMPT_WINDOW)
+        return True
 
 
 auth = AuthHandler()
@@ -49,12 +111,13 @@ def auth_required(func):
             return jsonify({"error": "Unauthorized! Token is missing."}), 401
 
         try:
-            token = token.split("Bearer ")[1]  # Extract the actual token
-            decoded_token = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            username = decoded_token["username"]
+            with metrics.span("auth"):
+                token = token.split("Bearer ")[1]  # Extract the actual token
+                decoded_token = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+                username = decoded_token["username"]
 
-            # ✅ Ensure we return a dictionary, not just a string
-            user = db.users_collection.find_one({"username": username}, {"_id": 0, "password": 0})
+                # ✅ Ensure we return a dictionary, not just a string (cached for a few seconds)
+                user = auth.get_user(username)
 
             if not user:
                 return jsonify({"error": "Invalid token. User not found!"}), 401
@@ -68,4 +131,4 @@ def auth_required(func):
         except Exception as e:
             return jsonify({"error": f"Authentication error: {str(e)}"}), 401
 
-    return wrapper
\ No newline at end of file
+    return wrapper
@@ -0,0 +1,389 @@
+"""Benchmarks the train, recommend and ingest hot paths against synthetic catalogs.
+
+Runs without MongoDB or TMDB: the database is replaced by mongomock and TMDB by a local
+stub HTTP server. Each catalog size runs in its own subprocess so peak RSS is per size.
+
+    pip install mongomock
+    python benchmark.py --sizes 1000,10000,100000 --output bench.json
+    python benchmark.py --sizes 1000000 --queries 200          # the 1M catalog takes a while
+    python benchmark.py --compare bench.json --output new.json  # ratios against an earlier run
+    python benchmark.py --backend ann --sizes 100000            # LSA + IVF retrieval, reports recall@10
+    python benchmark.py --import-only --import-budget-ms 1000   # CI check: `import app` stays cheap
+    python benchmark.py --scoring-workers 2 --sizes 10000       # shared-memory scoring, checked against in-process
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import subprocess
+import threading
+import tempfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+GENRES = ["Action", "Adventure", "Animation", "Comedy", "Crime", "Documentary", "Drama", "Family", "Fantasy",
+          "History", "Horror", "Music", "Mystery", "Romance", "Science Fiction", "Thriller", "War", "Western"]
+IMPORT_CHECK = """
+import sys, json, time
+started = time.perf_counter()
+import app
+seconds = time.perf_counter() - started
+from db_handler import db
+from fetch_movies import fetcher
+from movie_recommender import recommender
+print(json.dumps({"seconds": seconds, "database": db.loaded, "tmdb_fetcher": fetcher.loaded,
+                  "recommender": recommender.loaded, "scikit_learn": "sklearn" in sys.modules}))
+"""
+WORDS = ("love war space family secret journey city night dream heist revenge friend island robot king "
+         "murder ghost school summer road future past storm ocean dragon detective prison game band").split()
+
+
+def person_name(rng, pool_size):
+    """Zipf-like pick, so a few people appear in many movies like real catalogs."""
+    return f"Person{int(rng.paretovariate(1.2)) % pool_size}"
+
+
+def synthetic_movies(count, seed=0, start_id=1):
+    """Movies in the same document shape `MovieFetcher.fetch_and_store_movies` stores."""
+    rng = random.Random(seed)
+    people = max(100, count // 5)
+    for movie_id in range(start_id, start_id + count):
+        yield {
+            "id": movie_id,
+            "title": " ".join(rng.choices(WORDS, k=rng.randint(1, 4))).title(),
+            "overview": " ".join(rng.choices(WORDS, k=rng.randint(15, 40))),
+            "release_year": str(rng.randint(1950, 2025)),
+            "genres": rng.sample(GENRES, rng.randint(1, 3)),
+            "actors": [person_name(rng, people) for _ in range(5)],
+            "director": person_name(rng, people // 10),
+            "rating": round(rng.uniform(1, 9.5), 1),
+            "popularity": round(rng.expovariate(1 / 20), 3)
+        }
+
+
+class StubTMDBHandler(BaseHTTPRequestHandler):
+    """Serves the few TMDB endpoints `MovieFetcher` uses, with deterministic fake data."""
+
+    pages = 3
+    latency = 0.0
+    next_id = 10_000_000
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        rng = random.Random(self.path)
+
+        if url.path.endswith("/genre/movie/list"):
+            body = {"genres": [{"id": i, "name": name} for i, name in enumerate(GENRES)]}
+        elif url.path.endswith("/search/person"):
+            body = {"results": [{"id": abs(hash(params.get("query"))) % 1_000_000}]}
+        elif url.path.endswith("/discover/movie"):
+            page = int(params.get("page", 1))
+            person = int(params.get("with_cast") or params.get("with_crew") or 0)
+            base = self.next_id + (person * self.pages + page) * 20
+            body = {"page": page, "total_pages": self.pages, "results": [{
+                "id": base + i,
+                "title": " ".join(rng.choices(WORDS, k=3)).title(),
+                "overview": " ".join(rng.choices(WORDS, k=25)),
+                "release_date": f"{rng.randint(1950, 2025)}-01-01",
+                "genre_ids": rng.sample(range(len(GENRES)), 2)
+            } for i in range(20)]}
+        else:
+            body = {
+                "title": "Stub",
+                "vote_average": round(rng.uniform(1, 9.5), 1),
+                "popularity": round(rng.expovariate(1 / 20), 3),
+                "credits": {
+                    "cast": [{"name": f"Person{rng.randint(0, 5000)}"} for _ in range(8)],
+                    "crew": [{"job": "Director", "name": f"Person{rng.randint(0, 500)}"}]
+                }
+            }
+
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_stub_tmdb(latency_ms):
+    StubTMDBHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubTMDBHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/3"
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return {"p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": samples[-1] * 1000}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB on Linux
+
+
+def _accept_update_sort(mongomock):
+    """mongomock 4.x predates the `sort` argument pymongo >= 4.11 passes along with `UpdateOne`."""
+    builder = mongomock.collection.BulkOperationBuilder
+    add_update = builder.add_update
+    builder.add_update = lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs)
+
+
+def run_size(size, queries, ingest_people, tmdb_latency_ms, backend="exact", scoring_workers=0):
+    """Benchmarks one catalog size in this process (see `main` for the subprocess wrapper)."""
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("❌ The benchmark needs mongomock: pip install mongomock")
+    import pymongo
+
+    # Everything below talks to in-process stand-ins, never to a real database or TMDB
+    pymongo.MongoClient = mongomock.MongoClient
+    _accept_update_sort(mongomock)
+    os.environ.update({
+        "TMDB_BASE_URL": start_stub_tmdb(tmdb_latency_ms),
+        "TMDB_API_KEY": "benchmark",
+        "TMDB_RATE_LIMIT": "0",
+        "MODEL_ARTIFACT_DIR": tempfile.mkdtemp(prefix="bench-artifacts-"),
+        "RESULT_CACHE_TTL": "0",  # Measure scoring, not cache hits
+        "JOB_WORKERS": "0",  # Keep background ingestion out of the query timings
+        "RETRIEVAL_BACKEND": backend,
+        "SCORING_WORKERS": str(scoring_workers)
+    })
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull  # The app logs every movie and query
+        try:
+            return _run_size(size, queries, ingest_people)
+        finally:
+            sys.stdout = stdout
+
+
+def _run_size(size, queries, ingest_people):
+    from db_handler import db
+    from fetch_movies import fetcher
+    from movie_recommender import MovieRecommender, recommender
+    from result_cache import normalize_query
+
+    # mongomock checks unique indexes with a scan per insert; the stand-in doesn't need them
+    db.movies_collection.drop_indexes()
+    result = {"size": size, "backend": recommender.backend}
+
+    # Ingestion: stub TMDB round trips, detail fan-out and bulk upserts (cold TMDB response cache)
+    db.tmdb_cache_collection.delete_many({})
+    started = time.perf_counter()
+    stored = sum(len(fetcher.fetch_and_store_movies(actor_name=f"Ingest Person {i}").get("movies", []))
+                 for i in range(ingest_people))
+    elapsed = time.perf_counter() - started
+    result["ingest"] = {"movies": stored, "seconds": elapsed, "movies_per_second": stored / elapsed}
+    db.movies_collection.delete_many({})
+
+    db.movies_collection.insert_many(list(synthetic_movies(size)))
+
+    started = time.perf_counter()
+    db.fetch_movies()
+    result["mongo_fetch_seconds"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    recommender.train_model()
+    result["train_seconds"] = time.perf_counter() - started
+    if recommender.ann is not None:
+        result["ann"] = {"recall_at_10": recommender.ann.recall, "probes": recommender.ann.n_probe,
+                         "cells": len(recommender.ann.centroids)}
+
+    started = time.perf_counter()
+    MovieRecommender()  # Cold start from the artifact the training run saved
+    result["artifact_load_seconds"] = time.perf_counter() - started
+
+    rng = random.Random(1)
+    people = max(100, size // 5)
+    workload = []
+    for _ in range(queries):
+        genres = rng.sample(GENRES, rng.randint(1, 2)) if rng.random() < 0.8 else []  # Some name only people
+        actor = person_name(rng, people) if rng.random() < 0.6 else ""
+        director = person_name(rng, people // 10) if rng.random() < 0.3 or not (genres or actor) else ""
+        workload.append(normalize_query(actor, director, genres))
+
+    timings = []
+    for query in workload:
+        started = time.perf_counter()
+        recommender.score(query)
+        timings.append(time.perf_counter() - started)
+    result["score_latency_ms"] = percentiles(timings)
+
+    timings = []
+    for query in workload:
+        started = time.perf_counter()
+        recommender.recommend_movies(query, "benchmark")
+        timings.append(time.perf_counter() - started)
+    result["recommend_latency_ms"] = percentiles(timings)
+
+    if recommender.pool.enabled:
+        result["scoring_pool"] = check_scoring_pool(recommender, workload, size)
+
+    db.history_buffer.close()
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def check_scoring_pool(recommender, workload, size):
+    """Scores the workload through the scoring processes and in-process, after an incremental append.
+
+    Appended rows aren't in the published copy, so this catches pool results that differ from the
+    in-process ones and batches that fail over to in-process scoring.
+    """
+    from movie_recommender import scoring_fallbacks
+
+    recommender.start_scoring_pool()
+    recommender.add_movies(list(synthetic_movies(max(10, size // 100), seed=2, start_id=size + 1)))
+    queries = workload + [dict(query, min_rating=8.5) for query in workload]  # Small candidate sets too
+    fallbacks = sum(scoring_fallbacks.values.values())
+
+    started = time.perf_counter()
+    pooled = recommender.score_many(queries)
+    elapsed = time.perf_counter() - started
+    fallbacks = sum(scoring_fallbacks.values.values()) - fallbacks
+
+    workers, recommender.pool.workers = recommender.pool.workers, 0  # Same queries, scored in this process
+    try:
+        local = recommender.score_many(queries)
+    finally:
+        recommender.pool.workers = workers
+        recommender.pool.close()
+
+    return {"workers": workers, "queries": len(queries), "latency_ms_per_query": elapsed * 1000 / len(queries),
+            "mismatches": sum(a != b for a, b in zip(pooled, local)), "fallbacks": fallbacks}
+
+
+def pool_problems(results):
+    """Sizes whose scoring-pool check found mismatches or in-process fallbacks."""
+    return [f"size={run['size']}: scoring pool had {run['scoring_pool']['mismatches']} mismatches and "
+            f"{run['scoring_pool']['fallbacks']} fallbacks" for run in results
+            if run.get("scoring_pool") and (run["scoring_pool"]["mismatches"] or run["scoring_pool"]["fallbacks"])]
+
+
+def measure_import(runs=3):
+    """Best-of-`runs` time of `import app` in a fresh interpreter, and what that import set up.
+
+    MongoDB and TMDB point at closed ports, so an import that reaches for either also shows up as slow.
+    """
+    env = dict(os.environ, MONGO_URI="mongodb://127.0.0.1:9/?serverSelectionTimeoutMS=2000",
+               TMDB_BASE_URL="http://127.0.0.1:9/3")
+    results = [json.loads(subprocess.check_output([sys.executable, "-c", IMPORT_CHECK], text=True, env=env,
+                                                  cwd=os.path.dirname(os.path.abspath(__file__))).splitlines()[-1])
+               for _ in range(runs)]
+    return min(results, key=lambda result: result["seconds"])
+
+
+def import_problems(startup, budget_ms):
+    """Why `import app` is over budget (empty when it isn't): too slow, or it built something eagerly."""
+    problems = [f"{name} was loaded at import time" for name in ("database", "tmdb_fetcher", "recommender",
+                                                                 "scikit_learn") if startup[name]]
+    if budget_ms and startup["seconds"] * 1000 > budget_ms:
+        problems.append(f"import took {startup['seconds'] * 1000:.0f} ms (budget {budget_ms:.0f} ms)")
+    return problems
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    """Prints current/previous ratios for the headline metrics (> 1 means slower or bigger)."""
+    before = {run["size"]: run for run in previous["results"]}
+    for run in current["results"]:
+        old = before.get(run["size"])
+        if not old:
+            continue
+        print(f"size={run['size']}")
+        for name, get in [("train_seconds", lambda r: r["train_seconds"]),
+                          ("artifact_load_seconds", lambda r: r["artifact_load_seconds"]),
+                          ("score p99", lambda r: r["score_latency_ms"]["p99"]),
+                          ("recommend p99", lambda r: r["recommend_latency_ms"]["p99"]),
+                          ("peak_rss_mb", lambda r: r["peak_rss_mb"]),
+                          ("ingest seconds/movie", lambda r: 1 / r["ingest"]["movies_per_second"])]:
+            ratio = get(run) / get(old) if get(old) else float("inf")
+            print(f"  {name:<22} {get(old):>10.3f} -> {get(run):>10.3f}  x{ratio:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated catalog sizes")
+    parser.add_argument("--queries", type=int, default=500, help="queries timed per size")
+    parser.add_argument("--ingest-people", type=int, default=3, help="actors ingested from the stub TMDB server")
+    parser.add_argument("--tmdb-latency-ms", type=float, default=20, help="simulated TMDB round-trip time")
+    parser.add_argument("--backend", choices=("exact", "ann"), default="exact", help="retrieval backend")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    parser.add_argument("--import-budget-ms", type=float, default=1500,
+                        help="fail when `import app` takes longer than this (0 only checks for eager setup)")
+    parser.add_argument("--import-only", action="store_true", help="only run the import-time check")
+    parser.add_argument("--scoring-workers", type=int, default=0,
+                        help="score through this many shared-memory processes, checked against in-process results")
+    parser.add_argument("--single-size", type=int, help=argparse.SUPPRESS)  # Subprocess mode
+    args = parser.parse_args()
+
+    if args.single_size:
+        print(json.dumps(run_size(args.single_size, args.queries, args.ingest_people, args.tmdb_latency_ms,
+                                  args.backend, args.scoring_workers)))
+        return
+
+    startup = measure_import()
+    problems = import_problems(startup, args.import_budget_ms)
+    print(f"⏱️ import app: {startup['seconds'] * 1000:.0f} ms", file=sys.stderr)
+    for problem in problems:
+        print(f"❌ {problem}", file=sys.stderr)
+    if args.import_only:
+        print(json.dumps(startup, indent=2))
+        sys.exit(1 if problems else 0)
+
+    results = []
+    for size in (int(size) for size in args.sizes.split(",")):
+        print(f"⏱️ Benchmarking a catalog of {size} movies...", file=sys.stderr)
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), "--single-size", str(size), "--queries", str(args.queries),
+            "--ingest-people", str(args.ingest_people), "--tmdb-latency-ms", str(args.tmdb_latency_ms),
+            "--backend", args.backend, "--scoring-workers", str(args.scoring_workers)
+        ], text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "import": startup,
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    for problem in pool_problems(results):
+        print(f"❌ {problem}", file=sys.stderr)
+        problems.append(problem)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
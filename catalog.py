@@ -0,0 +1,277 @@
+import math
+from array import array
+import numpy as np
+
+INTERNED_COLUMNS = ("actors", "director", "genres")  # Names stored once, rows hold int codes
+
+
+def _as_text(value):
+    """Lists (genres, actors) are space-joined like the TF-IDF text; missing values become ''."""
+    if isinstance(value, list):
+        return " ".join(value)
+    return "" if value is None else str(value)
+
+
+def _as_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(number) else number
+
+
+def _as_year(value):
+    try:
+        return int(str(value)[:4])
+    except (TypeError, ValueError):
+        return 0  # Unknown
+
+
+def _as_names(value):
+    """Names of a list field (or a single-valued one such as `director`), without blanks."""
+    values = value if isinstance(value, list) else [value]
+    return [str(name) for name in values if name is not None and str(name).strip()]
+
+
+def _to_python(value):
+    """float32 -> float without the binary noise (7.3, not 7.300000190734863)."""
+    return float(str(value))
+
+
+def normalize_name(name):
+    """Lookup key for a name: lower-cased with collapsed whitespace."""
+    return " ".join(str(name).lower().split())
+
+
+def load_array(path, mmap_mode):
+    try:
+        return np.load(path, mmap_mode=mmap_mode)
+    except ValueError:  # Zero-length arrays can't be memory-mapped
+        return np.load(path)
+
+
+def document_record(movie):
+    """Response record for a MongoDB movie document, in the same shape as `MovieCatalog.record`."""
+    record = {"id": movie.get("id"), "title": _as_text(movie.get("title"))}
+    record.update({column: _as_text(movie.get(column)) for column in INTERNED_COLUMNS})
+    record["rating"] = _as_number(movie.get("rating"))
+    record["popularity"] = _as_number(movie.get("popularity"))
+    return record
+
+
+def searchable_text(movie):
+    """The text that gets vectorized for one movie document."""
+    return " ".join(_as_text(movie.get(field)) for field in ("title", "overview", "genres", "actors", "director"))
+
+
+class StringColumn:
+    """UTF-8 strings packed into one byte blob plus an offsets array (both mmap-friendly)."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, values):
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(blob, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return self.blob[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+
+    def concat(self, other):
+        offsets = np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]])
+        return StringColumn(np.concatenate([self.blob, other.blob]), offsets)
+
+    def save(self, path, name):
+        np.save(f"{path}/{name}_blob.npy", self.blob)
+        np.save(f"{path}/{name}_offsets.npy", self.offsets)
+
+    @classmethod
+    def load(cls, path, name, mmap_mode="r"):
+        return cls(load_array(f"{path}/{name}_blob.npy", mmap_mode),
+                   load_array(f"{path}/{name}_offsets.npy", mmap_mode))
+
+
+class InternedColumn:
+    """Multi-valued categorical column: each distinct name is stored once, rows hold int32 codes."""
+
+    def __init__(self, names, codes, offsets):
+        self.names = names  # Python list, code -> name
+        self.codes = codes  # int32, every row's codes back to back
+        self.offsets = offsets  # int64, row `r` is codes[offsets[r]:offsets[r + 1]]
+        self._lookup = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return [self.names[code] for code in self.codes[self.offsets[row]:self.offsets[row + 1]]]
+
+    def text(self, row):
+        return " ".join(self[row])
+
+    def lookup(self, name):
+        """Codes whose name matches `name` case- and whitespace-insensitively."""
+        if self._lookup is None:
+            lookup = {}
+            for code, known in enumerate(self.names):
+                lookup.setdefault(normalize_name(known), []).append(code)
+            self._lookup = lookup
+        return self._lookup.get(normalize_name(name), [])
+
+    def append(self, other):
+        """Returns a new column with `other`'s rows, re-coded into this column's vocabulary."""
+        codes_by_name = {name: code for code, name in enumerate(self.names)}
+        names = list(self.names)
+        remap = np.empty(len(other.names), dtype=np.int32)
+        for code, name in enumerate(other.names):
+            if name not in codes_by_name:
+                codes_by_name[name] = len(names)
+                names.append(name)
+            remap[code] = codes_by_name[name]
+        return InternedColumn(names, np.concatenate([self.codes, remap[other.codes]]),
+                              np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]]))
+
+    def save(self, path, name):
+        StringColumn.from_strings(self.names).save(path, f"{name}_names")
+        np.save(f"{path}/{name}_codes.npy", self.codes)
+        np.save(f"{path}/{name}_offsets.npy", self.offsets)
+
+    @classmethod
+    def load(cls, path, name, mmap_mode="r"):
+        packed = StringColumn.load(path, f"{name}_names", mmap_mode=None)
+        names = [packed[code] for code in range(len(packed))]
+        return cls(names, load_array(f"{path}/{name}_codes.npy", mmap_mode),
+                   load_array(f"{path}/{name}_offsets.npy", mmap_mode))
+
+
+class CatalogBuilder:
+    """Builds a `MovieCatalog` one document at a time into compact typed arrays.
+
+    `consume` passes documents straight through, so training can stream a MongoDB cursor into
+    the vectorizer and the catalog in a single pass without holding the documents.
+    """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.rating = array("f")
+        self.popularity = array("f")
+        self.years = array("h")
+        self.titles = []
+        self.codes = {column: array("i") for column in INTERNED_COLUMNS}
+        self.counts = {column: array("q") for column in INTERNED_COLUMNS}
+        self.vocabulary = {column: {} for column in INTERNED_COLUMNS}  # name -> code
+
+    def add(self, movie):
+        self.ids.append(movie.get("id"))
+        self.rating.append(_as_number(movie.get("rating")))
+        self.popularity.append(_as_number(movie.get("popularity")))
+        self.years.append(_as_year(movie.get("release_year")))
+        self.titles.append(_as_text(movie.get("title")))
+        for column in INTERNED_COLUMNS:
+            vocabulary = self.vocabulary[column]
+            codes = list(dict.fromkeys(vocabulary.setdefault(name, len(vocabulary))
+                                       for name in _as_names(movie.get(column))))
+            self.codes[column].extend(codes)
+            self.counts[column].append(len(codes))
+
+    def consume(self, movies):
+        """Adds and passes on each document; documents without an `id` can't be indexed and are skipped."""
+        for movie in movies:
+            if movie.get("id") is None:
+                continue
+            self.add(movie)
+            yield movie
+
+    def build(self):
+        columns = {}
+        for column in INTERNED_COLUMNS:
+            offsets = np.zeros(len(self.counts[column]) + 1, dtype=np.int64)
+            np.cumsum(np.frombuffer(self.counts[column], dtype=np.int64), out=offsets[1:])
+            columns[column] = InternedColumn(list(self.vocabulary[column]),
+                                             np.frombuffer(self.codes[column], dtype=np.int32).copy(), offsets)
+        return MovieCatalog(
+            np.frombuffer(self.ids, dtype=np.int64).copy(),
+            np.frombuffer(self.rating, dtype=np.float32).copy(),
+            np.frombuffer(self.popularity, dtype=np.float32).copy(),
+            np.frombuffer(self.years, dtype=np.int16).copy(),
+            StringColumn.from_strings(self.titles),
+            columns
+        )
+
+
+class MovieCatalog:
+    """Columnar movie metadata, addressed by the same row ids as the TF-IDF matrix."""
+
+    def __init__(self, ids, rating, popularity, years, titles, columns):
+        self.ids = ids
+        self.rating = rating  # float32
+        self.popularity = popularity  # float32
+        self.years = years  # int16 release year, 0 when unknown
+        self.titles = titles  # StringColumn
+        self.columns = columns  # "genres" / "actors" / "director" -> InternedColumn
+
+    @classmethod
+    def from_documents(cls, movies):
+        builder = CatalogBuilder()
+        for movie in movies:
+            if movie.get("id") is not None:
+                builder.add(movie)
+        return builder.build()
+
+    @classmethod
+    def empty(cls):
+        return cls.from_documents([])
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def is_empty(self):
+        return len(self) == 0
+
+    def append(self, other):
+        """Returns a new catalog with `other`'s rows after this one's."""
+        return MovieCatalog(
+            np.concatenate([self.ids, other.ids]),
+            np.concatenate([self.rating, other.rating]),
+            np.concatenate([self.popularity, other.popularity]),
+            np.concatenate([self.years, other.years]),
+            self.titles.concat(other.titles),
+            {column: self.columns[column].append(other.columns[column]) for column in INTERNED_COLUMNS}
+        )
+
+    def record(self, row):
+        """Response record for one row."""
+        record = {"id": int(self.ids[row]), "title": self.titles[row]}
+        record.update({column: self.columns[column].text(row) for column in INTERNED_COLUMNS})
+        record["rating"] = _to_python(self.rating[row])
+        record["popularity"] = _to_python(self.popularity[row])
+        return record
+
+    def save(self, path):
+        np.save(f"{path}/ids.npy", self.ids)
+        np.save(f"{path}/rating.npy", self.rating)
+        np.save(f"{path}/popularity.npy", self.popularity)
+        np.save(f"{path}/years.npy", self.years)
+        self.titles.save(path, "title")
+        for column, values in self.columns.items():
+            values.save(path, column)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        return cls(
+            load_array(f"{path}/ids.npy", mmap_mode),
+            load_array(f"{path}/rating.npy", mmap_mode),
+            load_array(f"{path}/popularity.npy", mmap_mode),
+            load_array(f"{path}/years.npy", mmap_mode),
+            StringColumn.load(path, "title", mmap_mode),
+            {column: InternedColumn.load(path, column, mmap_mode) for column in INTERNED_COLUMNS}
+        )
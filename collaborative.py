@@ -0,0 +1,333 @@
+"""Offline collaborative signal from the recommendation history.
+
+Streams `recommendation_history` into a sparse user × movie matrix of implicit feedback (how often
+a movie was recommended to a user), then precomputes per movie the movies most often recommended
+to the same users, and per user the best such movies they have not been shown yet. Runs are
+incremental: only history written since the previous run is read, and only the movies and users
+it touches are recomputed. Serving blends the saved lists into each top-k in O(k log N).
+
+    python collaborative.py          # fold in the history written since the last run (e.g. from cron)
+    python collaborative.py --full   # rebuild from the whole history
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from array import array
+from datetime import datetime, timedelta
+import numpy as np
+import scipy.sparse as sp
+from dotenv import load_dotenv
+from catalog import StringColumn, load_array
+from db_handler import db, encode_history_cursor
+
+# Load environment variables
+load_dotenv()
+COLLAB_ARTIFACT_DIR = os.getenv("COLLAB_ARTIFACT_DIR", "collab_artifacts")
+COLLAB_NEIGHBORS = int(os.getenv("COLLAB_NEIGHBORS", "50"))  # Co-recommended movies kept per movie
+COLLAB_USER_TOP_N = int(os.getenv("COLLAB_USER_TOP_N", "200"))  # Precomputed candidates kept per user
+COLLAB_WEIGHT = float(os.getenv("COLLAB_WEIGHT", "0.2"))  # match_score + weight × user score; 0 disables blending
+COLLAB_LAG_SECONDS = int(os.getenv("COLLAB_LAG_SECONDS", "60"))  # Newest history is left for the next run
+COLLAB_RELOAD_INTERVAL = int(os.getenv("COLLAB_RELOAD_INTERVAL", "60"))  # Seconds between checks for a newer model
+COLLAB_FORMAT = 1  # Bump when the on-disk layout changes
+CHUNK = 1000  # Rows per sparse product
+
+
+def _top(indices, scores, n):
+    """The `n` best `(indices, scores)`, best first."""
+    if len(scores) > n:
+        keep = np.argpartition(-scores, n - 1)[:n]
+        indices, scores = indices[keep], scores[keep]
+    order = np.argsort(-scores, kind="stable")
+    return indices[order], scores[order]
+
+
+def _resize(matrix, shape):
+    """`matrix` (CSR) padded with empty rows and columns up to `shape`."""
+    indptr = np.concatenate([matrix.indptr, np.full(shape[0] - matrix.shape[0], matrix.indptr[-1])])
+    return sp.csr_matrix((matrix.data, matrix.indices, indptr), shape=shape)
+
+
+def _unpack(packed, n, dtype):
+    """Per-row `(values, scores)` slices of packed lists, padded with empty rows up to `n`."""
+    offsets, values, scores = packed
+    lists = [(values[offsets[row]:offsets[row + 1]], scores[offsets[row]:offsets[row + 1]])
+             for row in range(len(offsets) - 1)]
+    return lists + [(np.zeros(0, dtype=dtype), np.zeros(0, dtype=np.float32))] * (n - len(lists))
+
+
+def _pack(lists, dtype):
+    """Per-row `(values, scores)` lists as CSR-style `(offsets, values, scores)` arrays."""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(values) for values, _ in lists], out=offsets[1:])
+    values = np.concatenate([np.zeros(0, dtype=dtype)] + [values for values, _ in lists]).astype(dtype)
+    scores = np.concatenate([np.zeros(0, dtype=np.float32)] + [scores for _, scores in lists]).astype(np.float32)
+    return offsets, values, scores
+
+
+class CollaborativeModel:
+    """Implicit feedback counts plus the lists precomputed from them, all as compact arrays."""
+
+    def __init__(self, usernames, item_ids, counts, neighbors, candidates, watermark=None):
+        self.usernames = usernames  # Python list, user code -> username
+        self.item_ids = item_ids  # int64, item code -> TMDB id
+        self.counts = counts  # CSR users × items, times each movie was recommended to each user
+        self.neighbors = neighbors  # (offsets, item codes, P(j | i)) per item, best first
+        self.candidates = candidates  # (offsets, TMDB ids ascending, score in (0, 1]) per user
+        self.watermark = watermark  # `encode_history_cursor` of the last history entry folded in
+        self._user_codes = None
+
+    @classmethod
+    def empty(cls):
+        empty = (np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+        return cls([], np.zeros(0, dtype=np.int64), sp.csr_matrix((0, 0), dtype=np.float32), empty,
+                   (empty[0], np.zeros(0, dtype=np.int64), empty[2]))
+
+    def scores_for(self, username, movie_ids):
+        """The user's precomputed score for each of `movie_ids` (0 if not a candidate), or None for unknown users.
+
+        Binary searches in the user's id-sorted list, so a top-k costs O(k log N).
+        """
+        if self._user_codes is None:
+            self._user_codes = {name: code for code, name in enumerate(self.usernames)}
+        code = self._user_codes.get(username)
+        if code is None:
+            return None
+        offsets, ids, scores = self.candidates
+        ids, scores = ids[offsets[code]:offsets[code + 1]], scores[offsets[code]:offsets[code + 1]]
+        if len(ids) == 0:
+            return None
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(ids, movie_ids), len(ids) - 1)
+        return np.where(ids[positions] == movie_ids, scores[positions], 0)
+
+    def update(self, entries, neighbors=COLLAB_NEIGHBORS, top_n=COLLAB_USER_TOP_N):
+        """A new model with `entries` (from `db.iter_history`) folded in, or this one if there were none.
+
+        Only movies recommended to a user with new entries get new neighbour lists, and only users
+        holding one of those movies get new candidate lists; every other list is copied as is.
+        """
+        usernames = list(self.usernames)
+        user_codes = {name: code for code, name in enumerate(usernames)}
+        item_codes = {int(movie_id): code for code, movie_id in enumerate(self.item_ids)}
+        rows, cols = array("i"), array("i")
+        last, folded = None, 0
+        for entry in entries:
+            last, folded = entry, folded + 1
+            if not isinstance(entry.get("recommendations"), list):
+                continue  # "No matching movies found!"
+            user = user_codes.setdefault(entry["username"], len(usernames))
+            if user == len(usernames):
+                usernames.append(entry["username"])
+            for movie in entry["recommendations"]:
+                if movie.get("id") is not None:
+                    rows.append(user)
+                    cols.append(item_codes.setdefault(int(movie["id"]), len(item_codes)))
+        if last is None:
+            return self
+
+        item_ids = np.fromiter(item_codes, dtype=np.int64, count=len(item_codes))  # Dict order is code order
+        shape = (len(usernames), len(item_ids))
+        rows, cols = np.frombuffer(rows, dtype=np.int32), np.frombuffer(cols, dtype=np.int32)
+        counts = _resize(self.counts, shape) + sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+        seen = counts.copy()
+        seen.data[:] = 1
+        by_item = seen.T.tocsr()  # items × users
+        users_per_item = np.diff(by_item.indptr).astype(np.float32)
+
+        # Co-occurrence only changes between movies shown to a user with new entries
+        touched = np.unique(rows)
+        affected = np.unique(seen[touched].indices)
+        neighbor_lists = _unpack(self.neighbors, shape[1], np.int32)
+        for start in range(0, len(affected), CHUNK):
+            chunk = affected[start:start + CHUNK]
+            together = (by_item[chunk] @ seen).tocsr()  # Users recommended both movies
+            for row, item in enumerate(chunk):
+                others = together.indices[together.indptr[row]:together.indptr[row + 1]]
+                shared = together.data[together.indptr[row]:together.indptr[row + 1]]
+                keep = others != item
+                neighbor_lists[item] = _top(others[keep].astype(np.int32),
+                                            (shared[keep] / users_per_item[item]).astype(np.float32), neighbors)
+        neighbor_arrays = _pack(neighbor_lists, np.int32)
+
+        # A user's candidates depend on the neighbour lists of the movies they were shown
+        offsets, items, probabilities = neighbor_arrays
+        similarity = sp.csr_matrix((probabilities, items, offsets), shape=(shape[1], shape[1]))
+        weights = counts.copy()
+        weights.data = np.log1p(weights.data)  # Repeats count, with diminishing returns
+        refresh = np.union1d(touched, by_item[affected].indices)
+        candidate_lists = _unpack(self.candidates, shape[0], np.int64)
+        for start in range(0, len(refresh), CHUNK):
+            chunk = refresh[start:start + CHUNK]
+            scores = (weights[chunk] @ similarity).tocsr()
+            for row, user in enumerate(chunk):
+                items = scores.indices[scores.indptr[row]:scores.indptr[row + 1]]
+                values = scores.data[scores.indptr[row]:scores.indptr[row + 1]]
+                keep = ~np.isin(items, seen.indices[seen.indptr[user]:seen.indptr[user + 1]])  # Only unseen movies
+                items, values = _top(items[keep], values[keep], top_n)
+                if len(values):
+                    values = values / values[0]  # Best candidate scores 1
+                ids = item_ids[items]
+                order = np.argsort(ids)
+                candidate_lists[user] = (ids[order], values[order].astype(np.float32))
+
+        print(f"🤝 Folded in {folded} history entries: {len(affected)} movies and {len(refresh)} users recomputed "
+              f"({shape[0]} users, {shape[1]} movies)")
+        return CollaborativeModel(usernames, item_ids, counts, neighbor_arrays, _pack(candidate_lists, np.int64),
+                                  encode_history_cursor(last))
+
+    def save(self, path):
+        StringColumn.from_strings(self.usernames).save(path, "usernames")
+        np.save(f"{path}/item_ids.npy", self.item_ids)
+        np.save(f"{path}/counts_data.npy", self.counts.data)
+        np.save(f"{path}/counts_indices.npy", self.counts.indices)
+        np.save(f"{path}/counts_indptr.npy", self.counts.indptr)
+        for name, arrays in (("neighbor", self.neighbors), ("candidate", self.candidates)):
+            for part, values in zip(("offsets", "values", "scores"), arrays):
+                np.save(f"{path}/{name}_{part}.npy", values)
+        with open(f"{path}/meta.json", "w") as f:
+            json.dump({"format": COLLAB_FORMAT, "watermark": self.watermark, "shape": self.counts.shape,
+                       "created_at": datetime.utcnow().isoformat()}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        with open(f"{path}/meta.json") as f:
+            meta = json.load(f)
+        if meta.get("format") != COLLAB_FORMAT:
+            raise ValueError(f"unsupported collaborative model format {meta.get('format')}")
+
+        packed = StringColumn.load(path, "usernames", mmap_mode=None)
+        counts = sp.csr_matrix((load_array(f"{path}/counts_data.npy", mmap_mode),
+                                load_array(f"{path}/counts_indices.npy", mmap_mode),
+                                load_array(f"{path}/counts_indptr.npy", mmap_mode)),
+                               shape=tuple(meta["shape"]), copy=False)
+        neighbors, candidates = (tuple(load_array(f"{path}/{name}_{part}.npy", mmap_mode)
+                                       for part in ("offsets", "values", "scores"))
+                                 for name in ("neighbor", "candidate"))
+        return cls([packed[code] for code in range(len(packed))], load_array(f"{path}/item_ids.npy", mmap_mode),
+                   counts, neighbors, candidates, meta["watermark"])
+
+
+class CollaborativeStore:
+    """Versioned copies of the collaborative model, in the same `LATEST` + staging layout as the model artifacts."""
+
+    def __init__(self, root=COLLAB_ARTIFACT_DIR, keep=2):
+        self.root = root
+        self.keep = keep
+
+    def save(self, model):
+        os.makedirs(self.root, exist_ok=True)
+        version = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}"
+
+        # Write into a temp dir and rename, so readers never see a half-written model
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.root)
+        try:
+            model.save(staging)
+            os.rename(staging, os.path.join(self.root, version))
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        latest = os.path.join(self.root, "LATEST")
+        with open(latest + ".tmp", "w") as f:
+            f.write(version)
+        os.replace(latest + ".tmp", latest)
+
+        versions = sorted(name for name in os.listdir(self.root)
+                          if os.path.isdir(os.path.join(self.root, name)) and not name.startswith("."))
+        for name in versions[:-self.keep]:
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+        print(f"💾 Saved collaborative model {version}")
+        return version
+
+    def latest(self):
+        try:
+            with open(os.path.join(self.root, "LATEST")) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def load(self, version=None):
+        """Memory-maps a saved model (the latest by default); None if there is none."""
+        version = version or self.latest()
+        return CollaborativeModel.load(os.path.join(self.root, version)) if version else None
+
+
+class CollaborativeScores:
+    """Serving side: blends the latest saved model into top-k lists, checking for a newer one now and then."""
+
+    def __init__(self, store=None, weight=COLLAB_WEIGHT, interval=COLLAB_RELOAD_INTERVAL):
+        self.store = store or CollaborativeStore()
+        self.weight = weight
+        self.interval = interval
+        self.model = None
+        self.version = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def current(self):
+        """The latest saved model, re-checking `LATEST` at most every `interval` seconds."""
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.interval:
+            return self.model
+        with self.lock:
+            if self.checked_at is None or now - self.checked_at >= self.interval:
+                self.checked_at = now
+                version = self.store.latest()
+                if version and version != self.version:
+                    try:
+                        self.model, self.version = self.store.load(version), version
+                        print(f"🤝 Loaded collaborative model {version} ({len(self.model.usernames)} users)")
+                    except (OSError, ValueError, KeyError) as e:
+                        print(f"⚠️ Could not load collaborative model {version}: {e}")
+        return self.model
+
+    def blend(self, username, records):
+        """Re-ranks a top-k by `match_score + weight × collab_score`; records the user has no score for stay as is.
+
+        O(k log N): a binary search per record in the user's precomputed list.
+        """
+        if self.weight <= 0 or not isinstance(records, list) or not records:
+            return records
+        model = self.current()
+        scores = model.scores_for(username, [record["id"] for record in records]) if model else None
+        if scores is None or not scores.any():
+            return records
+
+        blended = [dict(record, collab_score=round(float(score), 4)) if score > 0 else record
+                   for record, score in zip(records, scores)]
+        blended.sort(key=lambda record: (record["match_score"] + self.weight * record.get("collab_score", 0),
+                                         record["rating"], record["popularity"]), reverse=True)
+        return blended
+
+
+def run(full=False, store=None):
+    """Folds the history written since the last run into the saved model (everything with `full`)."""
+    store = store or CollaborativeStore()
+    model = None if full else store.load()
+    model = model or CollaborativeModel.empty()
+
+    started = time.perf_counter()
+    before = datetime.utcnow() - timedelta(seconds=COLLAB_LAG_SECONDS)  # Write-behind history may still land
+    updated = model.update(db.iter_history(after=model.watermark, before=before))
+    if updated is model:
+        print("✅ No new recommendation history since the last run")
+        return None
+    version = store.save(updated)
+    print(f"✅ Collaborative model {version} built in {time.perf_counter() - started:.1f}s")
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full", action="store_true", help="rebuild from the whole history")
+    args = parser.parse_args()
+    run(full=args.full)
+
+
+if __name__ == "__main__":
+    main()
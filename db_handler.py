@@ -1,26 +1,176 @@
 import os
+import atexit
+import bson
 import pymongo
 import bcrypt
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo.write_concern import WriteConcern
+from bson import ObjectId
+from bson.errors import InvalidId
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
+from catalog import document_record
+from lazy import LazySingleton
+from metrics import metrics, MongoCommandMetrics
+from write_buffer import WriteBehindBuffer
 
 # Load environment variables
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))  # Shared by all Flask threads
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))  # Warm connections kept open
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))  # Fail fast when the pool is exhausted
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+HISTORY_STORAGE_MODE = os.getenv("HISTORY_STORAGE_MODE", "full")  # "full" copies records, "ids" stores movie ids
+HISTORY_TTL_DAYS = int(os.getenv("HISTORY_TTL_DAYS", "0"))  # 0 keeps history forever
+HISTORY_MAX_PER_USER = int(os.getenv("HISTORY_MAX_PER_USER", "0"))  # 0 means no cap
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100"))
+HISTORY_SEEN_ENTRIES = int(os.getenv("HISTORY_SEEN_ENTRIES", "50"))  # Newest entries checked by `exclude_seen`
+HISTORY_FLUSH_SIZE = int(os.getenv("HISTORY_FLUSH_SIZE", "100"))  # Entries per insert_many
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))  # Seconds before a partial batch is written
+HISTORY_MAX_PENDING = int(os.getenv("HISTORY_MAX_PENDING", "10000"))  # Entries beyond this are dropped
+HISTORY_WRITE_CONCERN = int(os.getenv("HISTORY_WRITE_CONCERN", "1"))  # 0 = unacknowledged writes
+TMDB_CACHE_RETENTION_DAYS = int(os.getenv("TMDB_CACHE_RETENTION_DAYS", "30"))  # Then cached TMDB responses expire
+MOVIE_FIELDS = ("id", "title", "overview", "genres", "actors", "director", "release_year", "rating", "popularity")
+EPOCH = datetime(1970, 1, 1)
+
+
+class HistoryPage:
+    """One page of a user's history, streamed from the Mongo cursor.
+
+    `next_cursor` is only known once iteration has finished.
+    """
+
+    def __init__(self, mongo_cursor, limit, hydrate, batch_size=50):
+        self.mongo_cursor = mongo_cursor
+        self.limit = limit
+        self.hydrate = hydrate
+        self.batch_size = batch_size
+        self.next_cursor = None
+
+    def __iter__(self):
+        batch = []
+        for count, entry in enumerate(self.mongo_cursor):
+            if count == self.limit:
+                # One extra entry was read, so there is another page after the last one yielded
+                self.next_cursor = encode_history_cursor(last)
+                break
+            last = entry
+            batch.append(entry)
+            if len(batch) == self.batch_size:
+                yield from self._finish(batch)
+                batch = []
+        yield from self._finish(batch)
+
+    def _finish(self, batch):
+        self.hydrate(batch)
+        for entry in batch:
+            entry.pop("_id", None)
+            entry["timestamp"] = entry["timestamp"].isoformat()
+            yield entry
+
+
+def encode_history_cursor(entry):
+    """Opaque `<timestamp ms>-<ObjectId>` cursor pointing just after `entry`."""
+    millis = (entry["timestamp"] - EPOCH) // timedelta(milliseconds=1)
+    return f"{millis}-{entry['_id']}"
+
+
+def decode_history_cursor(cursor):
+    try:
+        millis, object_id = cursor.split("-", 1)
+        return EPOCH + timedelta(milliseconds=int(millis)), ObjectId(object_id)
+    except (ValueError, InvalidId):
+        raise ValueError("Invalid history cursor!")
 
 
 class DatabaseHandler:
     def __init__(self):
         """Initialize the database connection."""
         try:
-            self.client = pymongo.MongoClient(MONGO_URI)
+            # ✅ One client per process; its connection pool is shared by all request threads
+            self.client = pymongo.MongoClient(
+                MONGO_URI,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=MONGO_MAX_IDLE_MS,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                event_listeners=[MongoCommandMetrics(metrics)]  # ✅ Count and time every Mongo operation
+            )
             self.db = self.client["movie_db"]
             self.movies_collection = self.db["movies"]
             self.users_collection = self.db["users"]
             self.history_collection = self.db["recommendation_history"]  # ✅ Ensure this is initialized
+            self.tmdb_cache_collection = self.db["tmdb_cache"]  # Raw TMDB responses, see `fetch_movies.ResponseCache`
+            self.history_buffer = WriteBehindBuffer(
+                self._write_history_batch,
+                max_batch=HISTORY_FLUSH_SIZE,
+                flush_interval=HISTORY_FLUSH_INTERVAL,
+                max_pending=HISTORY_MAX_PENDING,
+                name="history-writer",
+                validate=bson.encode  # ✅ An entry Mongo can't store (e.g. an int above int64) fails alone
+            )
+            atexit.register(self.history_buffer.close)  # ✅ Don't lose buffered history on shutdown
             print("✅ Database connected successfully!")
         except Exception as e:
             print(f"❌ Database connection failed: {e}")
+            return
+
+        self.ensure_indexes()
+
+    def ensure_indexes(self):
+        """Creates the indexes used by the hot query paths (no-op when they already exist)."""
+        try:
+            self.users_collection.create_index([("username", ASCENDING)], unique=True)
+            self._ensure_unique_movie_ids()
+            self.movies_collection.create_index([("actors", ASCENDING)])
+            self.movies_collection.create_index([("director", ASCENDING)])
+            self.history_collection.create_index([("username", ASCENDING), ("timestamp", DESCENDING)])
+            self.history_collection.create_index([("timestamp", ASCENDING), ("_id", ASCENDING)])  # Offline scans
+            self._ensure_history_ttl()
+            self._ensure_ttl_index(self.tmdb_cache_collection, "fetched_at", TMDB_CACHE_RETENTION_DAYS * 24 * 3600)
+            print("✅ Database indexes are in place")
+        except Exception as e:
+            print(f"❌ Could not create database indexes: {e}")
+
+    def _ensure_history_ttl(self):
+        self._ensure_ttl_index(self.history_collection, "timestamp", HISTORY_TTL_DAYS * 24 * 3600)
+
+    def _ensure_ttl_index(self, collection, field, ttl):
+        """Expires documents `ttl` seconds after `field`; a ttl of 0 removes the index."""
+        if ttl > 0:
+            try:
+                collection.create_index([(field, ASCENDING)], expireAfterSeconds=ttl)
+            except OperationFailure:
+                # The TTL changed since the index was created; update it in place
+                self.db.command("collMod", collection.name,
+                                index={"keyPattern": {field: 1}, "expireAfterSeconds": ttl})
+        elif f"{field}_1" in collection.index_information():
+            collection.drop_index(f"{field}_1")
+
+    def _ensure_unique_movie_ids(self):
+        try:
+            self.movies_collection.create_index([("id", ASCENDING)], unique=True)
+        except OperationFailure:
+            # Older overlapping `insert_many` runs left duplicates behind; keep the first copy of each
+            removed = self.remove_duplicate_movies()
+            print(f"🧹 Removed {removed} duplicate movies before indexing `id`")
+            self.movies_collection.create_index([("id", ASCENDING)], unique=True)
+
+    def remove_duplicate_movies(self):
+        """Deletes all but one document per TMDB id."""
+        duplicates = self.movies_collection.aggregate([
+            {"$group": {"_id": "$id", "copies": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ])
+        extra_ids = [copy for group in duplicates for copy in group["copies"][1:]]
+        if not extra_ids:
+            return 0
+        return self.movies_collection.delete_many({"_id": {"$in": extra_ids}}).deleted_count
 
     def check_connection(self):
         """Check if the database is connected properly."""
@@ -32,7 +182,7 @@ class DatabaseHandler:
 
     def create_user(self, username, password, email):
         """Creates a new user with hashed password."""
-        if self.users_collection.find_one({"username": username}):
+        if self.users_collection.find_one({"username": username}, {"_id": 1}):
             return {"error": "Username already exists!"}
 
         hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
@@ -43,42 +193,195 @@ class DatabaseHandler:
             "email": email
         }
 
-        self.users_collection.insert_one(user_data)
+        try:
+            self.users_collection.insert_one(user_data)
+        except DuplicateKeyError:  # Lost a race with a concurrent registration
+            return {"error": "Username already exists!"}
         return {"message": "User registered successfully!"}
 
     def authenticate_user(self, username, password):
         """Authenticates a user by checking their credentials."""
-        user = self.users_collection.find_one({"username": username})
+        user = self.users_collection.find_one({"username": username}, {"_id": 0, "username": 1, "password": 1})
 
         if not user or not bcrypt.checkpw(password.encode("utf-8"), user["password"]):
             return None  # Invalid login
 
         return user  # Valid user
 
+    def get_user_profile(self, user):
+        """Returns the user's profile (never the password hash)."""
+        return self.users_collection.find_one({"username": user["username"]}, {"_id": 0, "password": 0})
+
+    def update_user_preferences(self, user, favorite_genres=None, watchlist=None):
+        """Updates the user's favorite genres and/or watchlist."""
+        changes = {key: value for key, value in (("favorite_genres", favorite_genres), ("watchlist", watchlist))
+                   if value is not None}
+        if changes:
+            self.users_collection.update_one({"username": user["username"]}, {"$set": changes})
+        return changes
+
     def store_recommendation(self, username, query, recommendations):
-        """Stores the user's recommendation history."""
+        """Queues the user's recommendation history; it is written in batches in the background."""
         if not hasattr(self, "history_collection"):
             self.history_collection = self.db["recommendation_history"]  # ✅ Ensure it's set before use
 
+        if HISTORY_STORAGE_MODE == "ids" and isinstance(recommendations, list):
+            # Store references only; `get_recommendation_history` hydrates them at read time
+            recommendations = [{"id": movie["id"], "match_score": movie.get("match_score")}
+                               for movie in recommendations]
+
         history_entry = {
             "username": username,
             "query": query,
             "recommendations": recommendations,
             "timestamp": datetime.utcnow()
         }
-        self.history_collection.insert_one(history_entry)
-        print(f"✅ Stored recommendation history for {username}")
+        with metrics.span("history"):
+            self.history_buffer.add(history_entry)
+
+    def _write_history_batch(self, entries):
+        """Flushes buffered history entries with one `insert_many` (called by the history writer thread)."""
+        collection = self.history_collection.with_options(write_concern=WriteConcern(w=HISTORY_WRITE_CONCERN))
+        collection.insert_many(entries, ordered=False)
+        for username in {entry["username"] for entry in entries}:
+            self._cap_history(username)
 
-    def get_recommendation_history(self, username):
-        """Retrieves the recommendation history of a user."""
+    def _cap_history(self, username):
+        """Keeps only the newest `HISTORY_MAX_PER_USER` entries for a user."""
+        if HISTORY_MAX_PER_USER <= 0:
+            return
+        oldest_kept = list(self.history_collection.find({"username": username}, {"timestamp": 1})
+                           .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+                           .skip(HISTORY_MAX_PER_USER - 1).limit(1))
+        if oldest_kept:
+            cutoff = oldest_kept[0]
+            self.history_collection.delete_many({"username": username, "$or": [
+                {"timestamp": {"$lt": cutoff["timestamp"]}},
+                {"timestamp": cutoff["timestamp"], "_id": {"$lt": cutoff["_id"]}}
+            ]})
+
+    def get_recommendation_history(self, username, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """Returns a lazily streamed page of the user's history, newest first.
+
+        `cursor` is the `next_cursor` of the previous page; raises ValueError if it is malformed.
+        """
+        if not hasattr(self, "history_collection"):
+            self.history_collection = self.db["recommendation_history"]  # ✅ Ensure it's set before use
+
+        limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+        query = {"username": username}
+        if cursor:
+            timestamp, object_id = decode_history_cursor(cursor)
+            query["$or"] = [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$lt": object_id}}
+            ]
+
+        mongo_cursor = (self.history_collection.find(query, {"username": 0})
+                        .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+                        .limit(limit + 1))
+        return HistoryPage(mongo_cursor, limit, self._hydrate_history)
+
+    def fetch_seen_movie_ids(self, username, entries=HISTORY_SEEN_ENTRIES):
+        """Ids of the movies recommended in the user's newest `entries` history entries (for `exclude_seen`).
+
+        Entries still waiting in the write-behind buffer are not included.
+        """
+        if not hasattr(self, "history_collection"):
+            self.history_collection = self.db["recommendation_history"]  # ✅ Ensure it's set before use
+
+        seen = set()
+        for entry in (self.history_collection.find({"username": username}, {"_id": 0, "recommendations.id": 1})
+                      .sort([("timestamp", DESCENDING), ("_id", DESCENDING)]).limit(entries)):
+            if isinstance(entry.get("recommendations"), list):
+                seen.update(movie["id"] for movie in entry["recommendations"] if "id" in movie)
+        return seen
+
+    def iter_history(self, after=None, before=None, batch_size=1000):
+        """Streams every user's history oldest first, for offline jobs (usernames and recommended ids only).
+
+        `after` is an `encode_history_cursor` value from a previous run. Entries from `before`
+        (a datetime) onwards are left for the next run, since buffered writes may still land there.
+        """
         if not hasattr(self, "history_collection"):
             self.history_collection = self.db["recommendation_history"]  # ✅ Ensure it's set before use
 
-        history = list(self.history_collection.find({"username": username}, {"_id": 0}))
-        return history if history else {"message": "No recommendation history found!"}
+        query = {"timestamp": {"$lt": before}} if before else {}
+        if after:
+            timestamp, object_id = decode_history_cursor(after)
+            query["$or"] = [
+                {"timestamp": {"$gt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$gt": object_id}}
+            ]
+        return (self.history_collection.find(query, {"username": 1, "timestamp": 1, "recommendations.id": 1})
+                .sort([("timestamp", ASCENDING), ("_id", ASCENDING)]).batch_size(batch_size))
+
+    def _hydrate_history(self, entries):
+        """Replaces id-only recommendations (`HISTORY_STORAGE_MODE=ids`) with full movie records."""
+        movie_ids = {movie["id"] for entry in entries if isinstance(entry.get("recommendations"), list)
+                     for movie in entry["recommendations"] if "title" not in movie}
+        if not movie_ids:
+            return
+
+        movies = {movie["id"]: movie for movie in self.movies_collection.find(
+            {"id": {"$in": list(movie_ids)}},
+            {"_id": 0, "id": 1, "title": 1, "actors": 1, "director": 1, "genres": 1, "rating": 1, "popularity": 1}
+        )}
+        for entry in entries:
+            if not isinstance(entry.get("recommendations"), list):
+                continue
+            hydrated = []
+            for movie in entry["recommendations"]:
+                if "title" in movie:
+                    hydrated.append(movie)
+                elif movie["id"] in movies:
+                    hydrated.append(dict(document_record(movies[movie["id"]]), match_score=movie.get("match_score")))
+            entry["recommendations"] = hydrated
 
     def fetch_movies(self):
         """Retrieve all movies from the database."""
         return list(self.movies_collection.find({}, {"_id": 0}))  # Exclude MongoDB `_id`
 
-db = DatabaseHandler()
+    def iter_movies(self, batch_size=1000):
+        """Streams every movie document with just the fields the model uses, in cursor batches."""
+        projection = {"_id": 0, **{field: 1 for field in MOVIE_FIELDS}}
+        return self.movies_collection.find({}, projection).batch_size(batch_size)
+
+    def fetch_movies_by_ids(self, movie_ids):
+        """Stored movies among `movie_ids` (model fields only), keyed by TMDB id; one indexed query."""
+        movie_ids = [movie_id for movie_id in set(movie_ids) if movie_id is not None]
+        if not movie_ids:
+            return {}
+        return {movie["id"]: movie for movie in self.movies_collection.find(
+            {"id": {"$in": movie_ids}}, {"_id": 0, **{field: 1 for field in MOVIE_FIELDS}})}
+
+    def movie_exists(self, **fields):
+        """Cheap indexed existence check, e.g. `movie_exists(actors="Tom Hanks")`."""
+        return self.movies_collection.find_one(fields, {"_id": 1}) is not None
+
+    def upsert_movies(self, movies):
+        """Bulk upserts movies keyed on the TMDB id, so overlapping fetches don't create duplicates."""
+        if not movies:
+            return 0
+        result = self.movies_collection.bulk_write(
+            [UpdateOne({"id": movie["id"]}, {"$set": movie}, upsert=True) for movie in movies],
+            ordered=False
+        )
+        return result.upserted_count
+
+    def fetch_movie_ids(self):
+        """Retrieve only the TMDB ids of all movies (used to fingerprint the catalog)."""
+        return [movie.get("id") for movie in self.movies_collection.find({}, {"_id": 0, "id": 1})]
+
+db = LazySingleton(DatabaseHandler, "database")  # Connects on first use
+
+
+def _history_buffer_samples():
+    stats = db.history_buffer.stats() if db.loaded and hasattr(db, "history_buffer") else {}
+    return [("movie_history_writes_total", "counter", "Recommendation history entries by outcome.",
+             [({"outcome": outcome}, stats.get(outcome, 0)) for outcome in ("written", "dropped", "failed")]),
+            ("movie_history_pending", "gauge", "History entries waiting to be flushed.",
+             [({}, stats.get("pending", 0))])]
+
+
+metrics.register_collector(_history_buffer_samples)
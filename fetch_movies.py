@@ -1,54 +1,244 @@
 import os
+import time
+import threading
 import requests
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+from pymongo.errors import PyMongoError
+from requests.adapters import HTTPAdapter
 from db_handler import db
+from lazy import LazySingleton
+from metrics import metrics
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
+TMDB_BASE_URL = os.getenv("TMDB_BASE_URL", "https://api.themoviedb.org/3")  # Point at a stub server in tests
+TMDB_MAX_WORKERS = int(os.getenv("TMDB_MAX_WORKERS", "8"))
+TMDB_RATE_LIMIT = float(os.getenv("TMDB_RATE_LIMIT", "40"))  # Requests per second, TMDB allows ~50
+TMDB_MAX_RETRIES = int(os.getenv("TMDB_MAX_RETRIES", "3"))
+TMDB_MAX_PAGES = int(os.getenv("TMDB_MAX_PAGES", "500"))  # TMDB never serves discover pages past 500
+TMDB_CACHE_TTL = {  # Seconds a cached response is used without asking TMDB, per endpoint; 0 disables caching it
+    "genre": int(os.getenv("TMDB_CACHE_TTL_GENRE", "604800")),
+    "search": int(os.getenv("TMDB_CACHE_TTL_SEARCH", "604800")),
+    "discover": int(os.getenv("TMDB_CACHE_TTL_DISCOVER", "86400")),
+    "movie": int(os.getenv("TMDB_CACHE_TTL_MOVIE", "604800")),
+}
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+tmdb_requests = metrics.counter("movie_tmdb_requests_total", "TMDB HTTP requests by endpoint and outcome.")
+tmdb_cache = metrics.counter("movie_tmdb_cache_total", "TMDB response cache lookups by endpoint and outcome.")
+
+
+class RateLimiter:
+    """Thread-safe token bucket shared by all requests of a fetcher."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """TMDB response bodies stored in MongoDB, keyed on the path and query (never the API key).
+
+    Fresh entries are served without a request. Stale ones are revalidated with their ETag /
+    Last-Modified, so an unchanged resource costs a 304 instead of a full download.
+    Lookup or write failures are logged and treated as misses.
+    """
+
+    def __init__(self, collection, ttl=TMDB_CACHE_TTL):
+        self.collection = collection
+        self.ttl = ttl
+
+    @staticmethod
+    def key(path, params):
+        return f"{path}?{urlencode(sorted(params.items()))}"
+
+    def enabled(self, endpoint):
+        return self.ttl.get(endpoint, 0) > 0
+
+    def get(self, key):
+        try:
+            return self.collection.find_one({"_id": key})
+        except PyMongoError as e:
+            print(f"⚠️ TMDB cache lookup failed: {e}")
+            return None
+
+    @staticmethod
+    def is_fresh(entry):
+        return entry["expires_at"] > datetime.utcnow()
+
+    @staticmethod
+    def validators(entry):
+        """Conditional request headers for revalidating a stale entry."""
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, key, endpoint, body, headers):
+        now = datetime.utcnow()
+        entry = {
+            "endpoint": endpoint,
+            "body": body,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "fetched_at": now,  # Also drives the TMDB_CACHE_RETENTION_DAYS TTL index
+            "expires_at": now + timedelta(seconds=self.ttl[endpoint])
+        }
+        try:
+            self.collection.replace_one({"_id": key}, entry, upsert=True)
+        except PyMongoError as e:
+            print(f"⚠️ Could not cache TMDB response for {key}: {e}")
+
+    def refresh(self, key, endpoint):
+        """Marks a revalidated (304) entry fresh again."""
+        now = datetime.utcnow()
+        try:
+            self.collection.update_one({"_id": key}, {"$set": {
+                "fetched_at": now, "expires_at": now + timedelta(seconds=self.ttl[endpoint])}})
+        except PyMongoError as e:
+            print(f"⚠️ Could not refresh cached TMDB response for {key}: {e}")
+
 
 class MovieFetcher:
-    def __init__(self):
-        self.genre_mapping = self.get_genre_mapping()
+    def __init__(self, base_url=TMDB_BASE_URL, api_key=TMDB_API_KEY, max_workers=TMDB_MAX_WORKERS,
+                 rate_limit=TMDB_RATE_LIMIT, max_retries=TMDB_MAX_RETRIES, max_pages=TMDB_MAX_PAGES, cache=None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.max_pages = max_pages
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.cache = cache  # ResponseCache, or None to always ask TMDB
+
+        # ✅ One pooled session shared by all worker threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tmdb")
+
+        self._genre_mapping = None
+
+    @property
+    def genre_mapping(self):
+        """TMDB genre id -> name, fetched on first use rather than at import time."""
+        if self._genre_mapping is None:
+            self._genre_mapping = self.get_genre_mapping()
+        return self._genre_mapping
+
+    def _get(self, path, **params):
+        """GET a TMDB endpoint under the rate limit, retrying with exponential backoff.
+
+        Goes through the response cache when one is set: fresh entries skip the request and
+        stale ones are revalidated with a conditional GET.
+        """
+        endpoint = path.split("/")[0]  # "movie/123" -> "movie", keeps label cardinality low
+        cache = self.cache if self.cache is not None and self.cache.enabled(endpoint) else None
+        cached, headers = None, {}
+        if cache:
+            key = cache.key(path, params)
+            cached = cache.get(key)
+            if cached is not None:
+                if cache.is_fresh(cached):
+                    tmdb_cache.inc(endpoint=endpoint, outcome="hit")
+                    return cached["body"]
+                headers = cache.validators(cached)
+
+        params["api_key"] = self.api_key
+        url = f"{self.base_url}/{path}"
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                with metrics.span("tmdb"):
+                    response = self.session.get(url, params=params, headers=headers, timeout=10)
+                tmdb_requests.inc(endpoint=endpoint, status=response.status_code)
+                if response.status_code == 304 and cached is not None:
+                    tmdb_cache.inc(endpoint=endpoint, outcome="revalidated")
+                    cache.refresh(key, endpoint)
+                    return cached["body"]
+                if response.status_code not in RETRYABLE_STATUS:
+                    response.raise_for_status()
+                    body = response.json()
+                    if cache:
+                        tmdb_cache.inc(endpoint=endpoint, outcome="miss" if cached is None else "changed")
+                        cache.store(key, endpoint, body, response.headers)
+                    return body
+                error = requests.HTTPError(f"{response.status_code} for {path}", response=response)
+                retry_after = response.headers.get("Retry-After")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                tmdb_requests.inc(endpoint=endpoint, status="connection_error")
+                error, retry_after = e, None
+
+            if attempt == self.max_retries:
+                raise error
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else 0.5 * 2 ** attempt
+            print(f"🔁 TMDB request to {path} failed ({error}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
 
     def get_genre_mapping(self):
         """Fetches genre mappings from TMDB API."""
-        url = f"https://api.themoviedb.org/3/genre/movie/list?api_key={TMDB_API_KEY}&language=en-US"
-        response = requests.get(url).json()
+        response = self._get("genre/movie/list", language="en-US")
         return {genre["id"]: genre["name"] for genre in response.get("genres", [])}
 
-    def fetch_movies_by_actor(self, actor_name):
-        """Fetches movies where the given actor appeared."""
-        url = f"https://api.themoviedb.org/3/search/person?api_key={TMDB_API_KEY}&query={actor_name}"
-        response = requests.get(url).json()
+    def _find_person_id(self, name):
+        response = self._get("search/person", query=name)
+        results = response.get("results")
+        return results[0]["id"] if results else None
 
-        if not response.get("results"):
-            return []
+    def _discover_all(self, **filters):
+        """Follows every `discover/movie` page, fetching pages 2..N concurrently."""
+        first = self._get("discover/movie", **filters)
+        movies = first.get("results", [])
+        total_pages = min(first.get("total_pages", 1) or 1, self.max_pages)
 
-        actor_id = response["results"][0]["id"]
-        movie_url = f"https://api.themoviedb.org/3/discover/movie?api_key={TMDB_API_KEY}&with_cast={actor_id}"
-        movies = requests.get(movie_url).json().get("results", [])
+        if total_pages > 1:
+            pages = self.executor.map(lambda page: self._get("discover/movie", page=page, **filters),
+                                      range(2, total_pages + 1))
+            for page in pages:
+                movies.extend(page.get("results", []))
 
-        return movies
+        # Pages can shift while we read them, so drop repeats
+        unique = {}
+        for movie in movies:
+            unique.setdefault(movie.get("id"), movie)
+        return list(unique.values())
+
+    def fetch_movies_by_actor(self, actor_name):
+        """Fetches movies where the given actor appeared."""
+        actor_id = self._find_person_id(actor_name)
+        return self._discover_all(with_cast=actor_id) if actor_id is not None else []
 
     def fetch_movies_by_director(self, director_name):
         """Fetches movies where the given director worked."""
-        url = f"https://api.themoviedb.org/3/search/person?api_key={TMDB_API_KEY}&query={director_name}"
-        response = requests.get(url).json()
-
-        if not response.get("results"):
-            return []
-
-        director_id = response["results"][0]["id"]
-        movie_url = f"https://api.themoviedb.org/3/discover/movie?api_key={TMDB_API_KEY}&with_crew={director_id}"
-        movies = requests.get(movie_url).json().get("results", [])
-
-        return movies
+        director_id = self._find_person_id(director_name)
+        return self._discover_all(with_crew=director_id) if director_id is not None else []
 
     def fetch_movie_details(self, movie_id):
         """Fetches detailed information (actors, director, rating, popularity) using the TMDB API."""
-        url = f"https://api.themoviedb.org/3/movie/{movie_id}?api_key={TMDB_API_KEY}&append_to_response=credits"
-        response = requests.get(url).json()
+        response = self._get(f"movie/{movie_id}", append_to_response="credits")
 
         # Extract actors (Top 5)
         actors = [cast["name"] for cast in response.get("credits", {}).get("cast", [])[:5]]
@@ -68,19 +258,27 @@ class MovieFetcher:
 
         return actors, director, rating, popularity
 
-    def fetch_and_store_movies(self, actor_name=None, director_name=None):
-        """Fetch and store movies automatically for an actor or a director."""
+    def _safe_movie_details(self, movie_id):
+        try:
+            return self.fetch_movie_details(movie_id)
+        except requests.RequestException as e:
+            print(f"❌ Skipping movie {movie_id}: {e}")
+            return None
+
+    def fetch_and_store_movies(self, actor_name=None, director_name=None, progress=None):
+        """Fetch and store movies automatically for an actor or a director.
+
+        `progress(done, total)` is called as movie details arrive, if given.
+        """
 
         if actor_name:
-            existing_movies = list(db.movies_collection.find({"actors": actor_name}, {"_id": 0}))
-            if existing_movies:
+            if db.movie_exists(actors=actor_name):
                 print(f"✅ Movies for actor {actor_name} already exist in the database.")
                 return {"message": f"Movies for actor {actor_name} already exist!"}
             movies = self.fetch_movies_by_actor(actor_name)
 
         elif director_name:
-            existing_movies = list(db.movies_collection.find({"director": director_name}, {"_id": 0}))
-            if existing_movies:
+            if db.movie_exists(director=director_name):
                 print(f"✅ Movies for director {director_name} already exist in the database.")
                 return {"message": f"Movies for director {director_name} already exist!"}
             movies = self.fetch_movies_by_director(director_name)
@@ -92,16 +290,26 @@ class MovieFetcher:
             print(f"❌ No movies found for {actor_name or director_name}")
             return {"error": f"No movies found for {actor_name or director_name}"}
 
+        # ✅ Movies already stored (e.g. a co-star's films) skip the detail call entirely
+        stored = db.fetch_movies_by_ids([movie.get("id") for movie in movies])
+        movies = [movie for movie in movies if movie.get("id") not in stored]
+
+        # ✅ Fetch full details concurrently (bounded by the pool size and rate limit)
+        details = self.executor.map(self._safe_movie_details, [movie.get("id") for movie in movies])
+
         formatted_movies = []
-        for movie in movies:
-            movie_id = movie.get("id")
-            actors, director, rating, popularity = self.fetch_movie_details(movie_id)  # Fetch full details
+        for done, (movie, movie_details) in enumerate(zip(movies, details), start=1):
+            if progress:
+                progress(done, len(movies))
+            if movie_details is None:
+                continue
+            actors, director, rating, popularity = movie_details
 
             formatted_movies.append({
-                "id": movie_id,
+                "id": movie.get("id"),
                 "title": movie.get("title"),
                 "overview": movie.get("overview", ""),
-                "release_year": movie.get("release_date", "")[:4],
+                "release_year": (movie.get("release_date") or "")[:4],
                 "genres": [self.genre_mapping.get(genre_id, "Unknown") for genre_id in movie.get("genre_ids", [])],
                 "actors": actors,  # List of actors
                 "director": director,  # Single director name
@@ -109,10 +317,22 @@ class MovieFetcher:
                 "popularity": popularity  # Movie popularity
             })
 
-        # Insert movies into MongoDB
-        db.movies_collection.insert_many(formatted_movies)
-        print(f"✅ Stored {len(formatted_movies)} movies for {actor_name or director_name}")
+        if not formatted_movies and not stored:
+            return {"error": f"Could not fetch movie details for {actor_name or director_name}"}
+
+        # Upsert on the TMDB id so overlapping runs don't store the same movie twice
+        inserted = db.upsert_movies(formatted_movies)
+        print(f"✅ Stored {len(formatted_movies)} movies ({inserted} new, {len(stored)} already stored) "
+              f"for {actor_name or director_name}")
+
+        return {
+            "message": f"Movies for {actor_name or director_name} stored successfully!",
+            # Stored and already-known documents, for incremental indexing (known ids are skipped there)
+            "movies": formatted_movies + list(stored.values())
+        }
+
+def _create_fetcher():
+    return MovieFetcher(cache=ResponseCache(db.tmdb_cache_collection) if hasattr(db, "tmdb_cache_collection") else None)
 
-        return {"message": f"Movies for {actor_name or director_name} stored successfully!"}
 
-fetcher = MovieFetcher()
+fetcher = LazySingleton(_create_fetcher, "TMDB fetcher")
@@ -0,0 +1,104 @@
+import numpy as np
+from catalog import INTERNED_COLUMNS
+
+YEAR_BUCKET = 10  # Release years are bucketed by decade
+EMPTY_ROWS = np.zeros(0, dtype=np.int64)
+
+
+class Postings:
+    """Sorted catalog rows per integer key, packed CSR-style: key `k` is rows[offsets[k]:offsets[k + 1]]."""
+
+    def __init__(self, keys, row_of_entry, n_keys, n_rows):
+        self.n_rows = n_rows
+        order = np.argsort(keys, kind="stable")  # Stable, so rows stay ascending within each key
+        self.rows = row_of_entry[order]
+        self.offsets = np.searchsorted(keys[order], np.arange(n_keys + 1))
+
+    def get(self, key):
+        return self.rows[self.offsets[key]:self.offsets[key + 1]] if 0 <= key < len(self.offsets) - 1 else EMPTY_ROWS
+
+    def union(self, keys):
+        found = [self.get(key) for key in keys]
+        found = [rows for rows in found if len(rows)]
+        if not found:
+            return EMPTY_ROWS
+        if len(found) == 1:
+            return found[0]
+        if sum(len(rows) for rows in found) < self.n_rows // 64:
+            return np.unique(np.concatenate(found))
+        mask = np.zeros(self.n_rows, dtype=bool)  # Big unions (e.g. two common genres): no sort needed
+        for rows in found:
+            mask[rows] = True
+        return np.flatnonzero(mask)
+
+
+class FilterIndex:
+    """Inverted indexes from structured movie fields to sorted catalog rows.
+
+    Derived from the catalog's int-coded columns (genres, actors, director), decade buckets and
+    whole-star rating bands, so restricted queries intersect small row arrays instead of scoring
+    the whole catalog.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.postings = {}
+        for column in INTERNED_COLUMNS:
+            values = catalog.columns[column]
+            rows = np.repeat(np.arange(len(values), dtype=np.int64), np.diff(values.offsets))
+            self.postings[column] = Postings(np.asarray(values.codes), rows, len(values.names), len(catalog))
+
+        rows = np.arange(len(catalog), dtype=np.int64)
+        decades = np.asarray(catalog.years) // YEAR_BUCKET
+        self.postings["year"] = Postings(decades, rows, int(decades.max(initial=0)) + 1, len(catalog))
+        bands = np.clip(np.asarray(catalog.rating), 0, None).astype(np.int64)
+        self.postings["rating"] = Postings(bands, rows, int(bands.max(initial=0)) + 1, len(catalog))
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def rows(self, column, names):
+        """Rows matching any of `names` in `column`, or None if none of the names is known.
+
+        Unknown names (e.g. an actor still being fetched) don't empty the result; the query
+        just falls back to text scoring for that field.
+        """
+        values = self.catalog.columns[column]
+        codes = [code for name in names if name for code in values.lookup(name)]
+        return self.postings[column].union(codes) if codes else None
+
+    def candidates(self, query):
+        """Sorted rows that satisfy every structured constraint of a `normalize_query` result.
+
+        Returns None when the query has no usable constraint (score the whole catalog).
+        """
+        selected = []
+        for column, names in (("genres", query["genres"]), ("actors", [query["actor"]]),
+                              ("director", [query["director"]])):
+            rows = self.rows(column, names)
+            if rows is not None:
+                selected.append(rows)
+
+        if query.get("min_rating") is not None:
+            min_rating = query["min_rating"]
+            bands = self.postings["rating"]
+            rows = bands.union(range(max(0, int(min_rating)), len(bands.offsets) - 1))
+            selected.append(rows[self.catalog.rating[rows] >= min_rating])
+
+        if query.get("year_range") is not None:
+            first, last = query["year_range"]
+            first, last = first or 1, last or 9999
+            decades = self.postings["year"]
+            newest = len(decades.offsets) - 2
+            rows = decades.union(range(max(1, first // YEAR_BUCKET), min(last // YEAR_BUCKET, newest) + 1))
+            years = self.catalog.years[rows]
+            selected.append(rows[(years >= first) & (years <= last)])
+
+        if not selected:
+            return None
+        # Intersect smallest first so each step works on the fewest rows
+        selected.sort(key=len)
+        rows = selected[0]
+        for other in selected[1:]:
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return rows
@@ -0,0 +1,125 @@
+import os
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from dotenv import load_dotenv
+from metrics import metrics
+
+# Load environment variables
+load_dotenv()
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "1000"))  # Finished jobs kept for `/jobs/<id>`
+
+
+class Job:
+    """A unit of background work plus the status reported by `/jobs/<id>`."""
+
+    def __init__(self, kind, key, func):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.func = func
+        self.status = "queued"
+        self.progress = {"done": 0, "total": None}
+        self.result = None
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+
+    def report(self, done, total=None):
+        """Progress callback handed to the job function."""
+        self.progress = {"done": done, "total": total}
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "type": self.kind,
+            "target": self.key[1] if isinstance(self.key, tuple) else self.key,
+            "status": self.status,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class JobQueue:
+    """Local job queue with a worker pool; jobs with the same key are de-duplicated while in flight."""
+
+    def __init__(self, workers=JOB_WORKERS, history_size=JOB_HISTORY_SIZE):
+        self.workers = workers
+        self.history_size = history_size
+        self.queue = queue.Queue()
+        self.jobs = OrderedDict()  # job id -> Job, oldest first
+        self.in_flight = {}  # key -> Job
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def submit(self, kind, key, func):
+        """Enqueue `func(progress)` unless a job with the same key is already queued or running."""
+        with self.lock:
+            job = self.in_flight.get(key)
+            if job:
+                return job
+
+            job = Job(kind, key, func)
+            self.jobs[job.id] = job
+            self.in_flight[key] = job
+            self._trim()
+            self._ensure_workers()
+
+        self.queue.put(job)
+        print(f"📥 Queued {kind} job {job.id} for {job.to_dict()['target']}")
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def stats(self):
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {status: statuses.count(status) for status in ("queued", "running", "done", "failed")}
+
+    def _ensure_workers(self):
+        # Workers start lazily so importing the module doesn't spawn threads
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"job-worker-{len(self.threads)}", daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def _trim(self):
+        while len(self.jobs) > self.history_size:
+            oldest_id, oldest = next(iter(self.jobs.items()))
+            if oldest.status in ("queued", "running"):
+                break
+            del self.jobs[oldest_id]
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            job.status = "running"
+            try:
+                job.result = job.func(job.report)
+                job.status = "done"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+                print(f"❌ Job {job.id} failed: {e}")
+            finally:
+                job.finished_at = datetime.utcnow()
+                with self.lock:
+                    if self.in_flight.get(job.key) is job:
+                        del self.in_flight[job.key]
+                self.queue.task_done()
+
+
+job_queue = JobQueue()
+metrics.register_collector(lambda: [(
+    "movie_jobs", "gauge", "Ingestion jobs currently tracked, by status.",
+    [({"status": status}, count) for status, count in job_queue.stats().items()]
+)])
@@ -0,0 +1,39 @@
+import threading
+
+
+class LazySingleton:
+    """Module-level singleton that is only built on first use (or by an explicit `load()` at warmup).
+
+    Attribute access is forwarded to the instance, so `from db_handler import db` call sites work
+    unchanged, but importing a module no longer connects to MongoDB, calls TMDB or trains the model.
+    """
+
+    def __init__(self, factory, name):
+        self._factory = factory
+        self._name = name
+        self._instance = None
+        self._lock = threading.Lock()
+        self.error = None  # Last failed build, reported by `/ready`
+
+    @property
+    def loaded(self):
+        return self._instance is not None
+
+    def load(self):
+        """Builds the instance once; concurrent callers wait for the same build."""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    try:
+                        self._instance = self._factory()
+                        self.error = None
+                    except Exception as e:
+                        self.error = str(e)  # The next access tries again
+                        raise
+        return self._instance
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return f"<lazy {self._name}: {'loaded' if self.loaded else 'not loaded'}>"
@@ -0,0 +1,171 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from pymongo import monitoring
+
+# Load environment variables
+load_dotenv()
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))  # 0 disables the slow-request log
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}  # sorted label tuple -> value
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self.values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # sorted label tuple -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[position] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, ('le', bound))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide counters, latency histograms and per-request stage breakdowns."""
+
+    def __init__(self, slow_request_ms=SLOW_REQUEST_MS):
+        self.slow_request_ms = slow_request_ms
+        self.metrics = {}
+        self.collectors = []  # Callables returning [(name, type, help, [(labels dict, value)])]
+        self.lock = threading.Lock()
+        self.local = threading.local()  # Stage breakdown of the request running on this thread
+        self.stage_seconds = self.histogram("movie_stage_duration_seconds", "Time spent per hot-path stage.")
+        self.request_seconds = self.histogram("movie_http_request_duration_seconds", "HTTP request latency.")
+        self.slow_requests = self.counter("movie_slow_requests_total", "Requests slower than SLOW_REQUEST_MS.")
+
+    def counter(self, name, help_text):
+        with self.lock:
+            return self.metrics.setdefault(name, Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        with self.lock:
+            return self.metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def register_collector(self, collector):
+        """Adds a callable whose samples (e.g. cache or queue stats) are read at scrape time."""
+        self.collectors.append(collector)
+
+    @contextmanager
+    def span(self, stage):
+        """Times a block into `movie_stage_duration_seconds{stage=...}` and the current request's breakdown."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def record(self, stage, seconds):
+        self.stage_seconds.observe(seconds, stage=stage)
+        breakdown = getattr(self.local, "breakdown", None)
+        if breakdown is not None:
+            breakdown[stage] = breakdown.get(stage, 0.0) + seconds
+
+    def start_request(self):
+        self.local.breakdown = {}
+        self.local.started = time.perf_counter()
+
+    def finish_request(self, method, path, endpoint, status):
+        """Records request latency and logs slow requests with their stage breakdown."""
+        started = getattr(self.local, "started", None)
+        breakdown = getattr(self.local, "breakdown", None) or {}
+        self.local.breakdown = self.local.started = None
+        if started is None:
+            return
+
+        elapsed = time.perf_counter() - started
+        self.request_seconds.observe(elapsed, endpoint=endpoint or "unknown", method=method, status=status)
+        if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+            self.slow_requests.inc(endpoint=endpoint or "unknown")
+            stages = " ".join(f"{stage}={seconds * 1000:.1f}ms"
+                              for stage, seconds in sorted(breakdown.items(), key=lambda item: -item[1]))
+            print(f"🐢 Slow request {method} {path} took {elapsed * 1000:.0f}ms ({stages or 'no stages recorded'})")
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        for collector in self.collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"⚠️ Metrics collector failed: {e}")
+                continue
+            for name, metric_type, help_text, values in samples:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+                lines += [f"{name}{_format_labels(sorted(labels.items()))} {value}" for labels, value in values]
+        return "\n".join(lines) + "\n"
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Counts and times every MongoDB command issued by the client it is registered on."""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.commands = registry.counter("movie_mongo_commands_total", "MongoDB commands by name and outcome.")
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+    def _finish(self, event, outcome):
+        self.commands.inc(command=event.command_name, outcome=outcome)
+        self.registry.record("mongo", event.duration_micros / 1_000_000)
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,96 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from datetime import datetime
+from dotenv import load_dotenv
+from ann_index import IvfAnnIndex
+from catalog import MovieCatalog
+from movie_index import IncrementalTfidfIndex
+
+# Load environment variables
+load_dotenv()
+MODEL_ARTIFACT_DIR = os.getenv("MODEL_ARTIFACT_DIR", "artifacts")
+MODEL_ARTIFACTS_KEPT = int(os.getenv("MODEL_ARTIFACTS_KEPT", "3"))
+ARTIFACT_FORMAT = 3  # Bump when the on-disk layout changes
+
+
+def catalog_checksum(movie_ids):
+    """Order-independent fingerprint of the set of movies an index was built from."""
+    ids = np.sort(np.fromiter(movie_ids, dtype=np.int64))
+    return hashlib.sha256(ids.tobytes()).hexdigest()
+
+
+class ArtifactStore:
+    """Versioned on-disk copies of the fitted index and catalog, loaded as shared memory maps."""
+
+    def __init__(self, root=MODEL_ARTIFACT_DIR, keep=MODEL_ARTIFACTS_KEPT):
+        self.root = root
+        self.keep = keep
+
+    def save(self, index, catalog, checksum, ann=None):
+        """Writes a new artifact version and points `LATEST` at it; returns the version name."""
+        os.makedirs(self.root, exist_ok=True)
+        version = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{checksum[:12]}"
+
+        # Write into a temp dir and rename, so readers never see a half-written artifact
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.root)
+        try:
+            index.save(staging)
+            catalog.save(staging)
+            if ann is not None:
+                ann.save(staging)
+            with open(os.path.join(staging, "meta.json"), "w") as f:
+                json.dump({
+                    "format": ARTIFACT_FORMAT,
+                    "checksum": checksum,
+                    "movies": len(catalog),
+                    "created_at": datetime.utcnow().isoformat()
+                }, f)
+            os.rename(staging, os.path.join(self.root, version))
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        latest = os.path.join(self.root, "LATEST")
+        with open(latest + ".tmp", "w") as f:
+            f.write(version)
+        os.replace(latest + ".tmp", latest)
+
+        self._prune(version)
+        print(f"💾 Saved model artifact {version}")
+        return version
+
+    def load(self, checksum=None):
+        """Memory-maps the latest artifact as `(index, catalog, ann, meta)`; None if missing or stale.
+
+        `ann` is None when the artifact was saved by the exact retrieval backend.
+        """
+        try:
+            with open(os.path.join(self.root, "LATEST")) as f:
+                path = os.path.join(self.root, f.read().strip())
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        except OSError:
+            return None
+
+        if meta.get("format") != ARTIFACT_FORMAT:
+            print(f"⚠️ Ignoring model artifact with format {meta.get('format')}")
+            return None
+        if checksum is not None and meta["checksum"] != checksum:
+            print("⚠️ Model artifact is stale (catalog checksum changed)")
+            return None
+
+        index = IncrementalTfidfIndex.load(path, mmap_mode="r")
+        catalog = MovieCatalog.load(path, mmap_mode="r")
+        ann = IvfAnnIndex.load(path, mmap_mode="r")
+        return index, catalog, ann, meta
+
+    def _prune(self, current):
+        versions = sorted(name for name in os.listdir(self.root)
+                          if os.path.isdir(os.path.join(self.root, name)) and not name.startswith("."))
+        for name in versions[:-self.keep] if self.keep > 0 else []:
+            if name != current:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
@@ -0,0 +1,96 @@
+import copy
+import json
+import numpy as np
+import scipy.sparse as sp
+
+
+class IncrementalTfidfIndex:
+    """TF-IDF index over a stable hashed vocabulary that can grow row by row."""
+
+    def __init__(self, n_features=2 ** 20):
+        from sklearn.feature_extraction.text import HashingVectorizer  # Deferred: scikit-learn is slow to import
+
+        self.n_features = n_features
+        self.vectorizer = HashingVectorizer(
+            stop_words="english", n_features=n_features, alternate_sign=False, norm=None
+        )
+        self.doc_freq = np.zeros(n_features, dtype=np.int64)
+        self.n_docs = 0
+        self.idf = np.ones(n_features, dtype=np.float64)
+        self.matrix = None  # L2-normalized TF-IDF rows, one per movie
+
+    def fit(self, texts):
+        """Rebuild the whole index from scratch (explicit or scheduled rebuilds only)."""
+        counts = self.vectorizer.transform(texts).tocsr()
+        self.doc_freq = np.bincount(counts.indices, minlength=self.n_features).astype(np.int64)
+        self.n_docs = counts.shape[0]
+        self._update_idf()
+        self.matrix = self._weight(counts)
+        return self.matrix
+
+    def partial_fit(self, texts):
+        """Append new documents as sparse rows, updating the IDF on the fly.
+
+        Existing rows keep the weights they were indexed with until the next `fit`.
+        """
+        counts = self.vectorizer.transform(texts).tocsr()
+        if counts.shape[0] == 0:
+            return self.matrix
+
+        # Not in-place: `doc_freq` may be a read-only memory map of a saved artifact
+        self.doc_freq = self.doc_freq + np.bincount(counts.indices, minlength=self.n_features)
+        self.n_docs += counts.shape[0]
+        self._update_idf()
+
+        rows = self._weight(counts)
+        self.matrix = rows if self.matrix is None else sp.vstack([self.matrix, rows], format="csr")
+        return self.matrix
+
+    def extend(self, texts):
+        """A copy with `texts` appended via `partial_fit`, leaving this index untouched for queries using it."""
+        extended = copy.copy(self)  # `partial_fit` rebinds the arrays rather than writing into them
+        extended.partial_fit(texts)
+        return extended
+
+    def transform(self, texts):
+        """Vectorize query texts with the current IDF."""
+        return self._weight(self.vectorizer.transform(texts).tocsr())
+
+    def save(self, path):
+        """Writes the IDF state and the CSR matrix (data / indices / indptr) as .npy files."""
+        np.save(f"{path}/doc_freq.npy", self.doc_freq)
+        np.save(f"{path}/idf.npy", self.idf)
+        np.save(f"{path}/matrix_data.npy", self.matrix.data)
+        np.save(f"{path}/matrix_indices.npy", self.matrix.indices)
+        np.save(f"{path}/matrix_indptr.npy", self.matrix.indptr)
+        with open(f"{path}/index.json", "w") as f:
+            json.dump({"n_features": self.n_features, "n_docs": self.n_docs, "shape": self.matrix.shape}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Loads a saved index; with `mmap_mode="r"` the arrays are shared page cache, not copies."""
+        with open(f"{path}/index.json") as f:
+            meta = json.load(f)
+
+        index = cls(meta["n_features"])
+        index.n_docs = meta["n_docs"]
+        index.doc_freq = np.load(f"{path}/doc_freq.npy", mmap_mode=mmap_mode)
+        index.idf = np.load(f"{path}/idf.npy", mmap_mode=mmap_mode)
+        index.matrix = sp.csr_matrix(
+            (np.load(f"{path}/matrix_data.npy", mmap_mode=mmap_mode),
+             np.load(f"{path}/matrix_indices.npy", mmap_mode=mmap_mode),
+             np.load(f"{path}/matrix_indptr.npy", mmap_mode=mmap_mode)),
+            shape=tuple(meta["shape"]), copy=False
+        )
+        return index
+
+    def _update_idf(self):
+        # Same smoothing as sklearn's TfidfTransformer(smooth_idf=True)
+        self.idf = np.log((1 + self.n_docs) / (1 + self.doc_freq)) + 1
+
+    def _weight(self, counts):
+        from sklearn.preprocessing import normalize
+
+        counts = counts.astype(np.float64)
+        counts.data *= self.idf[counts.indices]
+        return normalize(counts, norm="l2", copy=False)
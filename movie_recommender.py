@@ -1,100 +1,503 @@
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import os
+import math
+import hashlib
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from ann_index import IvfAnnIndex, ANN_DIMENSIONS
+from catalog import CatalogBuilder, MovieCatalog, searchable_text
+from collaborative import CollaborativeScores
 from db_handler import db
+from filters import FilterIndex
 from fetch_movies import fetcher
+from jobs import job_queue
+from lazy import LazySingleton
+from metrics import metrics
+from model_store import ArtifactStore, catalog_checksum
+from movie_index import IncrementalTfidfIndex
+from result_cache import RecommendationCache, normalize_query
+from retrieval import TopKRetriever
+from scoring_pool import ScoringPool
+
+# Load environment variables
+load_dotenv()
+INDEX_REBUILD_INTERVAL = int(os.getenv("INDEX_REBUILD_INTERVAL", "0"))  # Seconds, 0 disables scheduled rebuilds
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "exact")  # "exact" sparse cosine or "ann" (LSA + IVF)
+RECOMMEND_BATCH_MAX = int(os.getenv("RECOMMEND_BATCH_MAX", "50"))  # Queries accepted by `/recommend/batch`
+ANN_MIN_MOVIES = int(os.getenv("ANN_MIN_MOVIES", "10000"))  # Smaller catalogs always use exact retrieval
+ANN_TARGET_RECALL = float(os.getenv("ANN_TARGET_RECALL", "0.95"))  # recall@10 against exact, measured per build
+ANN_RECALL_QUERIES = int(os.getenv("ANN_RECALL_QUERIES", "200"))  # Sampled queries used to measure it
+ANN_FILTERED_MIN_SHARE = float(os.getenv("ANN_FILTERED_MIN_SHARE", "0.0625"))  # Larger filtered sets use ANN too
+index_updates = metrics.counter("movie_index_updates_total", "Full refits, artifact loads and incremental appends.")
+scoring_fallbacks = metrics.counter("movie_scoring_pool_fallbacks_total",
+                                    "Batches scored in-process because the scoring processes failed.")
+
+
+def appended_digest(digest, movie_ids):
+    """Folds one batch of appended movie ids into the running hash behind `model_version`."""
+    ids = np.sort(np.fromiter(movie_ids, dtype=np.int64))
+    return hashlib.sha256(digest.encode() + ids.tobytes()).hexdigest()
 
 
 class MovieRecommender:
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(stop_words="english")
+    def __init__(self, backend=RETRIEVAL_BACKEND):
+        if backend not in ("exact", "ann"):
+            print(f"⚠️ Unknown retrieval backend {backend!r}; using exact retrieval")
+            backend = "exact"
+        self.backend = backend
+        self.index = IncrementalTfidfIndex()
         self.movie_matrix = None
-        self.movies = pd.DataFrame()
-        self.train_model()
+        self.movies = MovieCatalog.empty()
+        self.filters = FilterIndex(self.movies)  # Structured pre-filters over the same rows
+        self.retriever = TopKRetriever(k=10)
+        self.ann = None  # IvfAnnIndex when `backend == "ann"` and the catalog is large enough
+        self.store = ArtifactStore()
+        self.cache = RecommendationCache()
+        self.collab = CollaborativeScores()  # Precomputed by `python collaborative.py`
+        self._base_checksum = ""  # Catalog checksum of the last full fit / loaded artifact
+        self._appended = ""  # Running hash of the movie ids appended since then; "" when none
+        self._fit_id = 0  # Bumped on every full fit / artifact load; names the copy the scoring pool serves
+        self.pool = ScoringPool()
+        self._lock = threading.Lock()
+        self._append_lock = threading.Lock()  # Serializes appends and full-fit swaps; held while an append builds
+        self._rebuild_thread = None
+        self.load_or_train()
+
+    def ingest(self, progress=None, actor_name=None, director_name=None):
+        """Fetches one actor's or director's movies from TMDB and indexes the new ones (job body)."""
+        result = fetcher.fetch_and_store_movies(actor_name=actor_name, director_name=director_name,
+                                                progress=progress)
+        result["indexed"] = self.add_movies(result.pop("movies", []))
+        return result
 
-    def fetch_and_train(self, actor=None, director=None, genres=None):
-        """Automatically fetch movies and train the model if necessary."""
+    def request_ingest(self, actor=None, director=None):
+        """Queues background ingestion for an actor and/or director; returns the jobs."""
+        jobs = []
         if actor:
-            fetcher.fetch_and_store_movies(actor_name=actor)
+            jobs.append(job_queue.submit("fetch_actor", ("actor", actor.lower()),
+                                         lambda progress: self.ingest(progress, actor_name=actor)))
         if director:
-            fetcher.fetch_and_store_movies(director_name=director)
+            jobs.append(job_queue.submit("fetch_director", ("director", director.lower()),
+                                         lambda progress: self.ingest(progress, director_name=director)))
+        return jobs
+
+    def load_or_train(self):
+        """Memory-maps the latest artifact and appends the movies stored since; refits only without one."""
+        loaded = self.store.load()
+        if not loaded:
+            self.train_model()
+            return
+
+        with self._append_lock:
+            self._install(loaded)
+        if self._append_stored(self.movies):
+            # Save the delta once, so later cold starts (in every worker) map it instead of appending
+            # again, and map it here too: the append left this worker with private copies of every array
+            with self._append_lock:
+                index, movies, ann = self.index, self.movies, self.ann
+                checksum = catalog_checksum(movies.ids)
+                if self._save_artifact(index, movies, checksum, ann):
+                    loaded = self.store.load(checksum)
+                    if loaded:
+                        self._install(loaded)
+        self._publish()
 
-        self.train_model()
+    def _install(self, loaded):
+        """Swaps in an artifact from `ArtifactStore.load` (the caller holds `_append_lock`)."""
+        index, movies, ann, meta = loaded
+        checksum = meta["checksum"]
+        filters = FilterIndex(movies)
+        index_updates.inc(kind="artifact_load")
+        if self.backend != "ann":
+            ann = None
+        elif ann is None or ann.dimensions != ANN_DIMENSIONS:
+            # Artifact written by the exact backend or with other settings; add a matching ANN index
+            ann = self._build_ann(index, index.matrix, movies)
+            if ann is not None:
+                self._save_artifact(index, movies, checksum, ann)
+
+        with self._lock:
+            self.index = index
+            self.movies = movies
+            self.filters = filters
+            self.movie_matrix = index.matrix
+            self.ann = ann
+            self._base_checksum, self._appended = checksum, ""
+            self._fit_id += 1
+        print(f"⚡ Loaded model artifact with {meta['movies']} movies")
+
+    def _append_stored(self, catalog):
+        """Appends the stored movies `catalog` lacks; returns how many were indexed."""
+        stored_ids = [movie_id for movie_id in db.fetch_movie_ids() if movie_id is not None]
+        missing = np.setdiff1d(np.asarray(stored_ids, dtype=np.int64), catalog.ids)
+        if not len(missing):
+            return 0
+        return self.add_movies(list(db.fetch_movies_by_ids(missing.tolist()).values()))
 
     def train_model(self):
-        """Trains the recommendation model only if new movies are added."""
-        new_movies = pd.DataFrame(db.fetch_movies())
+        """Fully rebuilds the recommendation model from the database and saves it as an artifact."""
+        movie_ids = [movie_id for movie_id in db.fetch_movie_ids() if movie_id is not None]
 
-        if new_movies.empty:
+        if not movie_ids:
             print("❌ No movies found in database! Fetching is required.")
             return
 
-        if self.movies.equals(new_movies):
+        if catalog_checksum(movie_ids) == self._base_checksum and not self._appended:
             print("✅ Model is already trained with the latest data.")
             return
 
-        self.movies = new_movies
-        print(f"🧠 Training model with {len(self.movies)} movies...")
+        print(f"🧠 Training model with {len(movie_ids)} movies...")
+        with metrics.span("train"):
+            # One pass over the cursor: each document feeds the catalog columns and the vectorizer,
+            # and its text is dropped right after hashing
+            builder = CatalogBuilder()
+            index = IncrementalTfidfIndex(self.index.n_features)
+            matrix = index.fit(searchable_text(movie) for movie in builder.consume(db.iter_movies()))
+            movies = builder.build()
+            filters = FilterIndex(movies)
+        checksum = catalog_checksum(movies.ids)  # Of what was actually read, in case movies were added meanwhile
+        index_updates.inc(kind="refit")
+        ann = self._build_ann(index, matrix, movies) if self.backend == "ann" else None
+
+        with self._append_lock, self._lock:
+            self.index = index
+            self.movies = movies
+            self.filters = filters
+            self.movie_matrix = matrix
+            self.ann = ann
+            self._base_checksum, self._appended = checksum, ""
+            self._fit_id += 1
+        print("✅ Movie recommendation model trained successfully!")
+        self._save_artifact(index, movies, checksum, ann)
+        # Movies appended while the cursor was being read were replaced by the swap; index them again
+        self._append_stored(movies)
+        self._publish()
 
-        # ✅ Convert lists to strings before concatenation
-        self.movies["genres"] = self.movies["genres"].apply(lambda x: " ".join(x) if isinstance(x, list) else str(x))
-        self.movies["actors"] = self.movies["actors"].apply(lambda x: " ".join(x) if isinstance(x, list) else str(x))
+    def _save_artifact(self, index, movies, checksum, ann):
+        try:
+            self.store.save(index, movies, checksum, ann)
+            return True
+        except OSError as e:
+            print(f"❌ Could not save model artifact: {e}")
+            return False
 
-        # ✅ Ensure rating and popularity exist
-        if "rating" not in self.movies:
-            self.movies["rating"] = 0  # Default rating
-        if "popularity" not in self.movies:
-            self.movies["popularity"] = 0  # Default popularity
+    def _build_ann(self, index, matrix, movies):
+        """Builds the LSA + IVF index and tunes its probes to ANN_TARGET_RECALL; None for small catalogs."""
+        if len(movies) < ANN_MIN_MOVIES:
+            print(f"ℹ️ {len(movies)} movies is below ANN_MIN_MOVIES={ANN_MIN_MOVIES}; using exact retrieval")
+            return None
 
-        self.movies["searchable_text"] = (
-                self.movies["title"].fillna("") + " " +
-                self.movies["overview"].fillna("") + " " +
-                self.movies["genres"].fillna("") + " " +
-                self.movies["actors"].fillna("") + " " +
-                self.movies["director"].fillna("")
-        )
+        with metrics.span("ann_build"):
+            ann = IvfAnnIndex().build(matrix)
+            recall = ann.calibrate(self._recall_queries(index, movies), matrix, movies.rating, movies.popularity,
+                                   ANN_TARGET_RECALL, k=self.retriever.k)
+        print(f"🧭 ANN index ready: {len(ann.centroids)} cells, {ann.n_probe} probes, "
+              f"{ann.rerank} re-ranked, recall@{self.retriever.k} {recall:.3f}")
+        return ann
 
-        self.movie_matrix = self.vectorizer.fit_transform(self.movies["searchable_text"])
-        print("✅ Movie recommendation model trained successfully!")
+    @staticmethod
+    def _recall_queries(index, movies, seed=0):
+        """Query vectors shaped like real requests (director + genres, or a title), sampled from the catalog."""
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(len(movies), min(ANN_RECALL_QUERIES, len(movies)), replace=False)
+        texts = []
+        for position, row in enumerate(rows.tolist()):
+            record = movies.record(row)
+            texts.append(f"{record['director']} {record['genres']}" if position % 2 == 0 else record["title"])
+        return index.transform(texts)
+
+    def add_movies(self, movies):
+        """Appends newly stored movies to the index without a full refit.
+
+        The new matrix, catalog, filters and ANN index are built beside the current ones; queries only
+        wait for the reference swap at the end.
+        """
+        movies = [movie for movie in movies if movie.get("id") is not None]  # Can't be indexed, as in `train_model`
+        with self._append_lock:  # One append at a time, and no full fit swapped in underneath it
+            with self._lock:
+                index, catalog, ann = self.index, self.movies, self.ann
+
+            indexed = np.isin([movie.get("id") for movie in movies], catalog.ids)
+            fresh = {}
+            for movie, seen in zip(movies, indexed):
+                if not seen:
+                    fresh.setdefault(movie.get("id"), movie)
+
+            if not fresh:
+                return 0
+
+            new_movies = list(fresh.values())
+            with metrics.span("index_append"):
+                index = index.extend(searchable_text(movie) for movie in new_movies)
+                catalog = catalog.append(MovieCatalog.from_documents(new_movies))
+                filters = FilterIndex(catalog)
+                if ann is not None:
+                    ann = ann.extend(index.matrix[-len(new_movies):])
+
+            with self._lock:
+                self.index = index
+                self.movies = catalog
+                self.filters = filters
+                self.movie_matrix = index.matrix
+                self.ann = ann
+                self._appended = appended_digest(self._appended, fresh)
+            index_updates.inc(kind="append")
+
+        print(f"➕ Indexed {len(fresh)} new movies ({len(catalog)} total)")
+        return len(fresh)
+
+    @property
+    def model_version(self):
+        """Changes whenever the index does; part of every result cache key.
+
+        Built from the catalog checksum and the ids appended since, rather than a per-process counter,
+        so workers that share a cache backend share entries only while they index the same movies.
+        """
+        version = f"{self._base_checksum[:16]}.{self._appended[:16] or 0}"
+        return f"{version}.ann" if self.ann is not None else version  # ANN results may differ from exact
+
+    def start_scoring_pool(self):
+        """Starts the SCORING_WORKERS scoring processes and publishes the current index to them."""
+        self.pool.start()
+        self._publish()
+
+    def _publish(self):
+        """Hot-swaps the scoring processes onto the latest full fit (no-op until the pool is started)."""
+        with self._lock:
+            fit_id, matrix, movies = self._fit_id, self.movie_matrix, self.movies
+        if matrix is None or self.pool.executor is None:
+            return
+        try:
+            self.pool.publish(fit_id, matrix, movies.rating, movies.popularity)
+        except OSError as e:  # e.g. /dev/shm too small; requests keep scoring in-process
+            print(f"❌ Could not publish the index to the scoring processes: {e}")
+
+    def start_rebuild_scheduler(self, interval=INDEX_REBUILD_INTERVAL):
+        """Runs a full `train_model()` rebuild every `interval` seconds in a background thread."""
+        if interval <= 0 or self._rebuild_thread is not None:
+            return
+
+        def rebuild_loop():
+            while not stop.wait(interval):
+                try:
+                    self.train_model()
+                except Exception as e:
+                    print(f"❌ Scheduled index rebuild failed: {e}")
+
+        stop = threading.Event()
+        self._rebuild_thread = threading.Thread(target=rebuild_loop, name="index-rebuild", daemon=True)
+        self._rebuild_thread.start()
+        print(f"⏱️ Scheduled full index rebuild every {interval} seconds")
 
     def recommend_movies(self, user_query, username):
-        """Automatically fetch and train if needed before recommending movies."""
-        actor = user_query.get("actor", "").strip()
-        director = user_query.get("director", "").strip()
-        genres = user_query.get("genres", [])
+        """Recommends movies from the current index, queuing a background fetch for new people."""
+        return self.recommend_batch([user_query], username)[0]
+
+    def recommend_batch(self, user_queries, username):
+        """One response per query, in order; unfiltered queries are scored in a single sparse product."""
+        responses = [None] * len(user_queries)
+        queries, excludes, pending_jobs = [], [], []
+        seen = None
+        for position, user_query in enumerate(user_queries):
+            actor = user_query.get("actor", "").strip()
+            director = user_query.get("director", "").strip()
+            genres = user_query.get("genres", [])
+            try:
+                min_rating, year_range = self._parse_filters(user_query)
+            except ValueError as e:
+                responses[position] = {"error": str(e)}
+                continue
+
+            # Fetching happens in the job queue; answer now from what is already indexed
+            pending_jobs.append(self.request_ingest(*self._unindexed(actor, director)))
+            queries.append((position, normalize_query(actor, director, genres, min_rating, year_range)))
+
+            # Seen movies are per user, so these queries bypass the shared result cache
+            if user_query.get("exclude_seen") and seen is None:
+                seen = db.fetch_seen_movie_ids(username)
+            excludes.append(seen if user_query.get("exclude_seen") else None)
+
+        scored = self.score_many([query for _, query in queries], excludes)
+        for (position, _), recommended_movies, jobs in zip(queries, scored, pending_jobs):
+            if isinstance(recommended_movies, dict):  # Error response
+                responses[position] = self._flag_pending(recommended_movies, jobs)
+                continue
+
+            # Personalize from the precomputed history lists (after the shared result cache)
+            recommended_movies = self.collab.blend(username, recommended_movies)
+
+            # ✅ Store the recommendation in history
+            db.store_recommendation(username, user_queries[position], recommended_movies)
+            responses[position] = self._flag_pending(
+                {"recommendations": recommended_movies if recommended_movies else "No matching movies found!"}, jobs)
+        return responses
+
+    def _unindexed(self, actor, director):
+        """`(actor, director)` with the names already in the index blanked out, since those need no fetch."""
+        filters = self.filters
+        return (actor if actor and filters.rows("actors", [actor]) is None else "",
+                director if director and filters.rows("director", [director]) is None else "")
+
+    @staticmethod
+    def _parse_filters(user_query):
+        """Validated `min_rating` and `year_range` (`[from, to]`, either may be null); raises ValueError."""
+        min_rating = user_query.get("min_rating")
+        if min_rating is not None:
+            try:
+                min_rating = float(min_rating)
+            except (TypeError, ValueError):
+                raise ValueError("min_rating must be a number!")
+            if not math.isfinite(min_rating):  # float() and the JSON parser both accept inf / NaN
+                raise ValueError("min_rating must be a number!")
+
+        year_range = user_query.get("year_range")
+        if year_range is not None:
+            if not isinstance(year_range, list) or len(year_range) != 2:
+                raise ValueError("year_range must be [from_year, to_year]!")
+            try:
+                year_range = [int(year) if year is not None else None for year in year_range]
+            except (TypeError, ValueError, OverflowError):  # OverflowError: int(inf)
+                raise ValueError("year_range must contain years or null!")
+        return min_rating, year_range
+
+    def score(self, query, exclude_ids=None):
+        """Top 10 records for a `normalize_query` result, served from the result cache when possible.
+
+        Structured fields narrow the candidate rows before scoring; `exclude_ids` (movie ids already
+        shown to the user) are removed too and bypass the cache. Returns an `{"error": ...}` dict
+        instead if the model is untrained or the query is empty.
+        """
+        return self.score_many([query], [exclude_ids])[0]
+
+    def score_many(self, queries, excludes=None):
+        """`score` for several queries; `excludes` holds each query's `exclude_ids` (or None)."""
+        excludes = excludes or [None] * len(queries)
+
+        # Take a consistent snapshot; `add_movies` may swap these concurrently
+        with self._lock:
+            movies, matrix, index, filters = self.movies, self.movie_matrix, self.index, self.filters
+            ann = self.ann
+            model_version, fit_id = self.model_version, self._fit_id
+
+        if movies.is_empty or matrix is None:
+            return [{"error": "Recommendation model is not trained. Please fetch movies first!"}] * len(queries)
+
+        results = [None] * len(queries)
+        batch = []  # (position, query, text, candidate rows) scored together below
+        for position, (query, exclude_ids) in enumerate(zip(queries, excludes)):
+            # Construct the query string based on available parameters
+            query_text = " ".join(filter(None, [query["actor"], " ".join(query["genres"]), query["director"]]))
+            if not query_text and "min_rating" not in query and "year_range" not in query:
+                results[position] = {"error": "Provide at least an actor, genre, or director!"}
+                continue
+
+            if exclude_ids is None:
+                with metrics.span("cache"):
+                    results[position] = self.cache.get(model_version, query)
+                if results[position] is not None:
+                    continue
+
+            with metrics.span("filter"):
+                rows = filters.candidates(query)
+                if exclude_ids:
+                    rows = np.arange(len(movies)) if rows is None else rows
+                    rows = rows[~np.isin(movies.ids[rows], list(exclude_ids))]
+
+            if ann is not None and query_text and (rows is None or len(rows) > len(movies) * ANN_FILTERED_MIN_SHARE):
+                with metrics.span("score"):
+                    # ✅ Top 10 by match_score, then rating, then popularity (all descending)
+                    top = ann.top_k(index.transform([query_text]), matrix, movies.rating, movies.popularity,
+                                    k=self.retriever.k, rows=rows)
+                # A filtered short list that can't fill k matching rows is rescored exactly below
+                if rows is None or (len(top) == self.retriever.k and top[-1][1] > 0):
+                    results[position] = self._build_records(movies, top)
+                    if exclude_ids is None:
+                        self.cache.set(model_version, query, results[position])
+                    continue
+            batch.append((position, query, query_text, rows))
+
+        if batch:
+            # Exact scoring for everything else in one batch; filtered queries only see their rows
+            with metrics.span("score"):
+                query_matrix = index.transform([query_text for _, _, query_text, _ in batch])
+                tops = self._top_k_batch(query_matrix, matrix, movies, fit_id, [rows for *_, rows in batch])
+            for (position, query, _, _), top in zip(batch, tops):
+                results[position] = self._build_records(movies, top)
+                if excludes[position] is None:
+                    self.cache.set(model_version, query, results[position])
+        return results
+
+    def _top_k_batch(self, query_matrix, matrix, movies, fit_id, rows):
+        """Top-k lists from the scoring processes when they serve this fit, else in this thread.
+
+        The processes hold the rows of the last full fit; rows appended since are scored here and
+        merged in, so fresh movies show up without republishing the whole matrix.
+        """
+        k = self.retriever.k
+        published = None
+        if self.pool.enabled:
+            try:
+                published = self.pool.top_k_batch(fit_id, query_matrix, k, rows)
+            except Exception as e:
+                scoring_fallbacks.inc()
+                print(f"⚠️ Scoring pool failed, scoring in-process: {e}")
+        if published is None:
+            return self.retriever.top_k_batch(query_matrix, matrix, movies.rating, movies.popularity, k, rows)
+
+        published_rows, tops = published
+        if matrix.shape[0] == published_rows:
+            return tops
+        tail_rows = [None if candidates is None else candidates[candidates >= published_rows] - published_rows
+                     for candidates in rows]
+        tails = self.retriever.top_k_batch(query_matrix, matrix[published_rows:], movies.rating[published_rows:],
+                                           movies.popularity[published_rows:], k, tail_rows)
+        return [self.retriever.merge([top, [(row + published_rows, score) for row, score in tail]],
+                                     movies.rating, movies.popularity, k)
+                for top, tail in zip(tops, tails)]
+
+    @staticmethod
+    def _flag_pending(response, jobs):
+        """Marks a response as possibly stale while ingestion jobs for the query are still running."""
+        pending = [job.id for job in jobs if job.status in ("queued", "running")]
+        if pending:
+            response["fresher_results_pending"] = True
+            response["pending_jobs"] = pending
+        return response
+
+    @staticmethod
+    def _build_records(movies, top):
+        """Turns `(row, score)` pairs into response records without touching shared state."""
+        records = []
+        for row, score in top:
+            record = movies.record(row)
+            record["match_score"] = score
+            records.append(record)
+        return records
 
-        # Auto-fetch and train if any key parameter is provided
-        if actor or director or genres:
-            self.fetch_and_train(actor, director, genres)
 
-        if self.movies.empty or self.movie_matrix is None:
-            return {"error": "Recommendation model is not trained. Please fetch movies first!"}
+recommender = LazySingleton(MovieRecommender, "recommender")  # Loads or trains the index on first use
 
-        # Construct the query string based on available parameters
-        query_text = " ".join(filter(None, [
-            actor,
-            " ".join(genres) if isinstance(genres, list) else genres,
-            director
-        ])).strip()
 
-        if not query_text:
-            return {"error": "Provide at least an actor, genre, or director!"}
+def _cache_samples():
+    if not recommender.loaded:
+        return []
+    stats = recommender.cache.stats()
+    return [("movie_result_cache_requests_total", "counter", "Result cache lookups by outcome.",
+             [({"outcome": "hit"}, stats["hits"]), ({"outcome": "miss"}, stats["misses"])]),
+            ("movie_result_cache_evictions_total", "counter", "Entries evicted from the in-process result cache.",
+             [({}, stats["evictions"] or 0)])]
 
-        query_vector = self.vectorizer.transform([query_text])
-        similarity_scores = cosine_similarity(query_vector, self.movie_matrix).flatten()
-        self.movies["match_score"] = similarity_scores
 
-        # ✅ Sort by match_score first, then by rating (descending), then by popularity (descending)
-        recommended_movies = (
-            self.movies.sort_values(by=["match_score", "rating", "popularity"], ascending=[False, False, False])
-            .head(10)[["title", "actors", "director", "genres", "rating", "popularity", "match_score"]]
-            .to_dict(orient="records")
-        )
+metrics.register_collector(_cache_samples)
 
-        # ✅ Store the recommendation in history
-        db.store_recommendation(username, user_query, recommended_movies)
 
-        return {"recommendations": recommended_movies if recommended_movies else "No matching movies found!"}
+def _ann_samples():
+    ann = recommender.ann if recommender.loaded else None
+    if ann is None:
+        return []
+    return [("movie_ann_recall", "gauge", "recall@10 of the ANN backend against exact retrieval, measured at build.",
+             [({}, ann.recall)]),
+            ("movie_ann_probes", "gauge", "IVF cells scanned per ANN query.", [({}, ann.n_probe)])]
 
 
-recommender = MovieRecommender()
+metrics.register_collector(_ann_samples)
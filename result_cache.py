@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "10000"))  # Entries kept by the in-process backend
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "300"))  # Seconds, 0 disables the cache
+RESULT_CACHE_URL = os.getenv("RESULT_CACHE_URL")  # Optional redis:// URL shared by all workers
+
+
+class LocalCacheBackend:
+    """In-process LRU + TTL store exposing the subset of the Redis API we use (`get` / `set` / `delete`)."""
+
+    def __init__(self, max_size=RESULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, name):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self.entries[name]
+                return None
+            self.entries.move_to_end(name)
+            return value
+
+    def delete(self, name):
+        with self.lock:
+            return 1 if self.entries.pop(name, None) is not None else 0
+
+    def set(self, name, value, ex=None):
+        with self.lock:
+            self.entries[name] = (time.monotonic() + ex if ex else None, value)
+            self.entries.move_to_end(name)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+
+def create_backend(url=RESULT_CACHE_URL):
+    """Uses Redis when `RESULT_CACHE_URL` is set and the client is installed, otherwise the local store."""
+    if url:
+        try:
+            import redis
+            return redis.Redis.from_url(url)
+        except ImportError:
+            print("⚠️ RESULT_CACHE_URL is set but the `redis` package is missing; using the in-process cache")
+    return LocalCacheBackend()
+
+
+def normalize_query(actor="", director="", genres=(), min_rating=None, year_range=None):
+    """Canonical form of a query, so "tom  hanks" and "Tom Hanks" share a cache entry.
+
+    Structured filters are only added when set, so plain queries keep their existing cache keys.
+    """
+    if isinstance(genres, str):
+        genres = genres.split()
+    query = {
+        "actor": " ".join(actor.lower().split()),
+        "director": " ".join(director.lower().split()),
+        "genres": sorted({" ".join(genre.lower().split()) for genre in genres if genre.strip()})
+    }
+    if min_rating is not None:
+        query["min_rating"] = float(min_rating)
+    if year_range is not None:
+        query["year_range"] = list(year_range)
+    return query
+
+
+class RecommendationCache:
+    """Caches recommendation results keyed on the normalized query plus the model version."""
+
+    def __init__(self, backend=None, ttl=RESULT_CACHE_TTL):
+        self.backend = backend if backend is not None else create_backend()
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model_version, query):
+        digest = hashlib.sha1(json.dumps(query, sort_keys=True).encode("utf-8")).hexdigest()
+        return f"rec:{model_version}:{digest}"
+
+    def get(self, model_version, query):
+        if self.ttl <= 0:
+            return None
+        try:
+            value = self.backend.get(self.key(model_version, query))
+        except Exception as e:  # A shared cache being down must not fail the request
+            print(f"⚠️ Result cache read failed: {e}")
+            value = None
+
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return json.loads(value) if value is not None else None
+
+    def set(self, model_version, query, recommendations):
+        if self.ttl <= 0:
+            return
+        try:
+            self.backend.set(self.key(model_version, query), json.dumps(recommendations), ex=self.ttl)
+        except Exception as e:
+            print(f"⚠️ Result cache write failed: {e}")
+
+    def stats(self):
+        with self.lock:
+            stats = {"hits": self.hits, "misses": self.misses}
+        stats["evictions"] = getattr(self.backend, "evictions", None)  # Only known for the local backend
+        stats["hit_ratio"] = stats["hits"] / max(1, stats["hits"] + stats["misses"])
+        return stats
@@ -0,0 +1,110 @@
+import numpy as np
+
+
+class TopKRetriever:
+    """Scores queries against L2-normalized rows and keeps only the best k candidates."""
+
+    def __init__(self, k=10):
+        self.k = k
+        self._fallback = (None, None, None)  # (ratings, popularity, best rows) of the last catalog seen
+
+    def score(self, query_vector, matrix):
+        """Cosine similarity as a single sparse dot product (rows and query are already normalized)."""
+        return np.asarray((matrix @ query_vector.T).todense()).ravel()
+
+    def top_k(self, query_vector, matrix, ratings, popularity, k=None, rows=None):
+        """Returns `(row, score)` pairs ordered by score, then rating, then popularity (all descending).
+
+        `rows` (sorted catalog rows from `FilterIndex.candidates`) restricts scoring to those rows.
+        """
+        if rows is None:
+            scores = self.score(query_vector, matrix)
+            return self.select(scores, ratings, popularity, k or self.k)
+
+        if len(rows) > matrix.shape[0] // 4:
+            scores = self.score(query_vector, matrix)[rows]  # Cheaper than copying most of the matrix
+        else:
+            scores = self.score(query_vector, matrix[rows])
+        top = self.select(scores, ratings[rows], popularity[rows], k or self.k)
+        return [(int(rows[row]), score) for row, score in top]
+
+    def top_k_batch(self, query_matrix, matrix, ratings, popularity, k=None, rows=None, chunk=16):
+        """`top_k` for every row of `query_matrix`; `rows` optionally holds each query's candidate rows.
+
+        Queries with few candidates score just those rows. The rest share sparse products over the
+        whole matrix that are never densified. Movies sharing no term with a query all score 0, so
+        when fewer than k rows match, the rest are filled with the best-rated 0-score rows, exactly
+        as `top_k` orders them.
+        """
+        k = k or self.k
+        rows = rows or [None] * query_matrix.shape[0]
+        results = [None] * query_matrix.shape[0]
+        broad = []
+        for position, candidates in enumerate(rows):
+            if candidates is not None and len(candidates) <= matrix.shape[0] // 16:
+                results[position] = self.top_k(query_matrix[position], matrix, ratings, popularity, k, candidates)
+            else:
+                broad.append(position)
+
+        for start in range(0, len(broad), chunk):  # Bounds the product on common terms
+            positions = broad[start:start + chunk]
+            scores = (matrix @ query_matrix[positions].T).tocsc()
+            for column, position in enumerate(positions):
+                matched = scores.indices[scores.indptr[column]:scores.indptr[column + 1]]
+                values = scores.data[scores.indptr[column]:scores.indptr[column + 1]]
+                candidates = rows[position]
+                if candidates is not None:
+                    keep = np.isin(matched, candidates, assume_unique=True)
+                    matched, values = matched[keep], values[keep]
+
+                top = [(int(matched[i]), score) for i, score in self.select(values, ratings[matched],
+                                                                            popularity[matched], k)]
+                if len(top) < k:
+                    seen = set(matched.tolist())
+                    if candidates is None:
+                        best = self._best_rows(ratings, popularity, 2 * k)
+                    else:
+                        best = [int(candidates[i]) for i, _ in self.select(
+                            np.zeros(len(candidates)), ratings[candidates], popularity[candidates], 2 * k)]
+                    top += [(row, 0.0) for row in best if row not in seen][:k - len(top)]
+                results[position] = top
+        return results
+
+    def _best_rows(self, ratings, popularity, count):
+        cached_ratings, cached_popularity, rows = self._fallback
+        if cached_ratings is not ratings or cached_popularity is not popularity or len(rows) < count:
+            rows = [row for row, _ in self.select(np.zeros(len(ratings)), ratings, popularity, count)]
+            self._fallback = (ratings, popularity, rows)
+        return rows[:count]
+
+    @classmethod
+    def merge(cls, tops, ratings, popularity, k):
+        """Combines `(row, score)` lists from disjoint row ranges into one top-k list."""
+        pairs = [pair for top in tops for pair in top]
+        if not pairs:
+            return []
+        rows = np.array([row for row, _ in pairs], dtype=np.int64)
+        scores = np.array([score for _, score in pairs], dtype=np.float64)
+        return [(int(rows[i]), score) for i, score in cls.select(scores, ratings[rows], popularity[rows], k)]
+
+    @staticmethod
+    def select(scores, ratings, popularity, k):
+        """O(n) selection with `np.argpartition`, then tie-breaks over the candidates only."""
+        n = scores.shape[0]
+        if n == 0 or k <= 0:
+            return []
+
+        if n <= k:
+            candidates = np.arange(n)
+        else:
+            partitioned = np.argpartition(-scores, k - 1)
+            threshold = scores[partitioned[k - 1]]
+            winners = partitioned[:k][scores[partitioned[:k]] > threshold]
+            # Rows tied with the k-th score compete on rating/popularity, like the full sort did
+            tied = np.flatnonzero(scores == threshold)
+            tied = tied[np.lexsort((-popularity[tied], -ratings[tied]))][:k - len(winners)]
+            candidates = np.concatenate([winners, tied])
+
+        order = np.lexsort((-popularity[candidates], -ratings[candidates], -scores[candidates]))
+        candidates = candidates[order][:k]
+        return list(zip(candidates.tolist(), scores[candidates].tolist()))
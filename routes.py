@@ -1,8 +1,10 @@
-from flask import Blueprint, request, jsonify
+import json
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from auth import auth, auth_required
-from db_handler import db
-from movie_recommender import recommender
-from fetch_movies import fetcher
+from db_handler import db, HISTORY_PAGE_SIZE
+from movie_recommender import recommender, RECOMMEND_BATCH_MAX
+from jobs import job_queue
+from metrics import metrics
 
 
 class Routes:
@@ -15,6 +17,32 @@ class Routes:
     def setup_routes(self):
         """Define all API routes."""
 
+        @self.api_blueprint.before_app_request
+        def start_request_metrics():
+            metrics.start_request()
+
+        @self.api_blueprint.after_app_request
+        def finish_request_metrics(response):
+            metrics.finish_request(request.method, request.path, request.endpoint, response.status_code)
+            return response
+
+        @self.api_blueprint.route("/metrics", methods=["GET"])
+        def prometheus_metrics():
+            """Prometheus text-format metrics: stage latencies, cache, TMDB, Mongo and job counters."""
+            return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+        @self.api_blueprint.route("/ready", methods=["GET"])
+        def ready():
+            """Readiness probe: 200 once the recommendation index is loaded, 503 while warming up."""
+            if recommender.loaded:
+                return jsonify({"status": "ready", "movies": len(recommender.movies),
+                                "model_version": recommender.model_version})
+            status = {"status": "warming_up", "database": db.loaded, "index": False}
+            error = recommender.error or db.error
+            if error:
+                status.update(status="unavailable", error=error)  # Retried by the next request that needs it
+            return jsonify(status), 503
+
         @self.api_blueprint.route("/register", methods=["POST"])
         def register():
             """Registers a new user."""
@@ -32,7 +60,10 @@ class Routes:
             if "username" not in data or "password" not in data:
                 return jsonify({"error": "Username and password are required!"}), 400
 
-            user = db.authenticate_user(data["username"], data["password"])
+            user, error = auth.authenticate_user(data["username"], data["password"])
+            if error:
+                message, status = error
+                return jsonify({"error": message}), status
             if not user:
                 return jsonify({"error": "Invalid username or password!"}), 401
 
@@ -52,20 +83,34 @@ class Routes:
             """Update user's favorite genres or watchlist."""
             data = request.json
             db.update_user_preferences(user, data.get("favorite_genres"), data.get("watchlist"))
+            auth.invalidate_user(user["username"])  # ✅ Don't serve the old profile from the auth cache
             return jsonify({"message": "Profile updated successfully!"})
 
         @self.api_blueprint.route("/fetch_movies", methods=["POST"])
         @auth_required
         def fetch_movies(user):
-            """Fetch movies for a given actor (Requires JWT)."""
+            """Queue a fetch of movies for a given actor (Requires JWT)."""
             data = request.json
             actor_name = data.get("actor", "").strip()
 
             if not actor_name:
                 return jsonify({"error": "Actor name is required!"}), 400
 
-            fetcher.fetch_and_store_movies(actor_name)
-            return jsonify({"message": f"Movies for {actor_name} fetched successfully!"})
+            job = recommender.request_ingest(actor=actor_name)[0]
+            return jsonify({
+                "message": f"Fetching movies for {actor_name}...",
+                "job_id": job.id,
+                "status_url": f"/jobs/{job.id}"
+            }), 202
+
+        @self.api_blueprint.route("/jobs/<job_id>", methods=["GET"])
+        @auth_required
+        def job_status(user, job_id):
+            """Reports the status and progress of a background fetch job."""
+            job = job_queue.get(job_id)
+            if not job:
+                return jsonify({"error": "Job not found!"}), 404
+            return jsonify(job)
 
         @self.api_blueprint.route("/recommend", methods=["POST"])
         @auth_required
@@ -79,12 +124,46 @@ class Routes:
             recommendations = recommender.recommend_movies(user_query, current_user["username"])
             return jsonify(recommendations)
 
+        @self.api_blueprint.route("/recommend/batch", methods=["POST"])
+        @auth_required
+        def recommend_batch(current_user):
+            """Recommendations for up to RECOMMEND_BATCH_MAX queries, scored together."""
+            queries = (request.json or {}).get("queries")
+            if not isinstance(queries, list) or not queries or not all(isinstance(query, dict) for query in queries):
+                return jsonify({"error": "Provide a non-empty list of queries!"}), 400
+            if len(queries) > RECOMMEND_BATCH_MAX:
+                return jsonify({"error": f"At most {RECOMMEND_BATCH_MAX} queries per batch!"}), 400
+
+            results = recommender.recommend_batch(queries, current_user["username"])
+            return jsonify({"results": results})
+
+        @self.api_blueprint.route("/cache_stats", methods=["GET"])
+        @auth_required
+        def cache_stats(current_user):
+            """Hit / miss / eviction counters of the recommendation result cache."""
+            return jsonify(recommender.cache.stats())
+
         @self.api_blueprint.route("/history", methods=["GET"])
         @auth_required
         def recommendation_history(current_user):
-            """Retrieves the recommendation history for a user."""
-            history = db.get_recommendation_history(current_user["username"])
-            return jsonify(history)
+            """Streams one page of the user's recommendation history (`?limit=` and `?cursor=`)."""
+            try:
+                page = db.get_recommendation_history(
+                    current_user["username"],
+                    limit=request.args.get("limit", HISTORY_PAGE_SIZE, type=int),
+                    cursor=request.args.get("cursor")
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            def generate():
+                # Entries are serialized one at a time, so a page is never built as a single string
+                yield '{"history": ['
+                for position, entry in enumerate(page):
+                    yield ("," if position else "") + json.dumps(entry, default=str)
+                yield '], "next_cursor": ' + json.dumps(page.next_cursor) + "}"
+
+            return Response(stream_with_context(generate()), mimetype="application/json")
 
         @self.api_blueprint.route("/check_db", methods=["GET"])
         def check_db():
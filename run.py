@@ -1,21 +1,24 @@
-from app import app
-from db_handler import db
-from movie_recommender import recommender
+import os
+
+
+def main():
+    # Imported here, not at module level: scoring processes re-import this module when they start
+    from app import create_app
+    from scoring_pool import SCORING_WORKERS
 
-if __name__ == "__main__":
     print("🚀 Starting Movie Recommendation System...")
 
-    # Ensure database connection
-    if db.check_connection():
-        print("✅ Database connected successfully!")
+    # Start the Flask API right away; the database and index load in the background (see `/ready`)
+    print("🚀 Starting Flask API...")
+    if SCORING_WORKERS > 0:
+        # Production serving: scoring runs in worker processes, Flask threads only handle I/O
+        app = create_app(schedule_rebuilds=True)
+        app.run(threaded=True, debug=False, use_reloader=False)
     else:
-        print("❌ Failed to connect to the database! Exiting...")
-        exit(1)  # Stop the application if the database is not connected
+        # The debug reloader runs this twice; only the serving child (WERKZEUG_RUN_MAIN) warms up
+        app = create_app(warmup_in_background=os.environ.get("WERKZEUG_RUN_MAIN") == "true", schedule_rebuilds=True)
+        app.run(debug=True)
 
-    # Train the recommender model
-    print("🧠 Training recommendation model...")
-    recommender.train_model()
 
-    # Start the Flask API
-    print("🚀 Starting Flask API...")
-    app.run(debug=True)
+if __name__ == "__main__":
+    main()
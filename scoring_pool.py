@@ -0,0 +1,181 @@
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import scipy.sparse as sp
+from dotenv import load_dotenv
+from retrieval import TopKRetriever
+
+# Load environment variables
+load_dotenv()
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "0"))  # Scoring processes, 0 scores in the request thread
+SCORING_TIMEOUT = float(os.getenv("SCORING_TIMEOUT", "10"))
+
+
+def _attach(name):
+    """Opens a segment the parent created.
+
+    Spawned workers share the parent's resource tracker, so registering the name again is a
+    no-op and the parent's `unlink` stays the only cleanup.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python >= 3.13
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedIndex:
+    """One published copy of the TF-IDF matrix and ranking columns in `multiprocessing.shared_memory`."""
+
+    ARRAYS = ("data", "indices", "indptr", "rating", "popularity")
+
+    def __init__(self, token, shape, segments, layout):
+        self.token = token
+        self.shape = shape
+        self.segments = segments  # name -> SharedMemory
+        self.layout = layout  # name -> (segment name, dtype, length)
+
+    @classmethod
+    def publish(cls, token, matrix, ratings, popularity):
+        arrays = dict(zip(cls.ARRAYS, (matrix.data, matrix.indices, matrix.indptr, ratings, popularity)))
+        segments, layout = {}, {}
+        try:
+            for name, values in arrays.items():
+                values = np.ascontiguousarray(values)
+                segment = shared_memory.SharedMemory(create=True, size=max(1, values.nbytes))
+                np.ndarray(values.shape, dtype=values.dtype, buffer=segment.buf)[:] = values
+                segments[name] = segment
+                layout[name] = (segment.name, values.dtype.str, len(values))
+        except Exception:
+            for segment in segments.values():
+                segment.close()
+                segment.unlink()
+            raise
+        return cls(token, matrix.shape, segments, layout)
+
+    @property
+    def handle(self):
+        """What a worker needs to attach: picklable and tiny."""
+        return {"token": self.token, "shape": self.shape, "layout": self.layout}
+
+    def unlink(self):
+        for segment in self.segments.values():
+            segment.close()
+            segment.unlink()
+
+
+# Worker-process state: the attached index of the newest token seen
+_worker = {"token": None, "segments": [], "matrix": None, "rating": None, "popularity": None,
+           "retriever": TopKRetriever()}
+
+
+def _worker_index(handle):
+    if _worker["token"] != handle["token"]:
+        # A retrain was published; drop the old mapping (the parent unlinks it once idle)
+        previous = _worker["segments"]
+        _worker.update(matrix=None, rating=None, popularity=None, retriever=TopKRetriever())
+        for segment in previous:
+            segment.close()
+        segments, arrays = [], {}
+        for name, (segment_name, dtype, length) in handle["layout"].items():
+            segment = _attach(segment_name)
+            segments.append(segment)
+            arrays[name] = np.ndarray((length,), dtype=np.dtype(dtype), buffer=segment.buf)
+        _worker.update(token=handle["token"], segments=segments, rating=arrays["rating"],
+                       popularity=arrays["popularity"],
+                       matrix=sp.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                                            shape=handle["shape"], copy=False))
+    return _worker
+
+
+def _score_batch(handle, data, indices, indptr, n_features, k, rows):
+    """Runs in a scoring process: top-k rows of the shared matrix for a batch of query vectors."""
+    index = _worker_index(handle)
+    queries = sp.csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, n_features))
+    return index["retriever"].top_k_batch(queries, index["matrix"], index["rating"], index["popularity"], k, rows)
+
+
+class ScoringPool:
+    """Scoring processes sharing one copy of the fitted matrix through shared memory.
+
+    Each full fit is published under a new token; requests in flight finish on the copy they
+    started with, and a replaced copy is unlinked once its last batch returns.
+    """
+
+    def __init__(self, workers=SCORING_WORKERS, timeout=SCORING_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self.executor = None
+        self.current = None  # SharedIndex serving new batches
+        self.in_flight = {}  # token -> batches running on it
+        self.retired = {}  # token -> replaced SharedIndex waiting for its batches to finish
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def start(self):
+        if not self.enabled or self.executor is not None:
+            return
+        # "spawn" so workers never inherit the app's threads, Mongo client or locks
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        atexit.register(self.close)
+        print(f"🧮 Started {self.workers} scoring processes")
+
+    def publish(self, token, matrix, ratings, popularity):
+        """Copies a freshly fitted matrix into shared memory and hot-swaps it in.
+
+        Tokens only move forward, so a slow publish of an older fit never replaces a newer one.
+        """
+        if self.executor is None or (self.current is not None and token <= self.current.token):
+            return
+        shared = SharedIndex.publish(token, matrix, ratings, popularity)
+        with self.lock:
+            if self.current is not None and token <= self.current.token:
+                shared.unlink()
+                return
+            previous, self.current = self.current, shared
+            if previous is not None:
+                self.retired[previous.token] = previous
+            self._unlink_idle()
+        print(f"🔁 Published index {token} ({matrix.shape[0]} movies) to the scoring processes")
+
+    def top_k_batch(self, token, query_matrix, k, rows=None):
+        """`(published rows, top-k lists)` for a batch of query vectors, or None if `token` isn't published.
+
+        Rows appended after the publish are not covered; the caller scores those itself.
+        """
+        with self.lock:
+            shared = self.current
+            if shared is None or shared.token != token:
+                return None
+            self.in_flight[token] = self.in_flight.get(token, 0) + 1
+        if rows is not None:
+            # Candidates may include appended rows the shared copy doesn't have
+            rows = [None if candidates is None else candidates[candidates < shared.shape[0]] for candidates in rows]
+        try:
+            future = self.executor.submit(_score_batch, shared.handle, query_matrix.data, query_matrix.indices,
+                                          query_matrix.indptr, query_matrix.shape[1], k, rows)
+            return shared.shape[0], future.result(timeout=self.timeout)
+        finally:
+            with self.lock:
+                self.in_flight[token] -= 1
+                self._unlink_idle()
+
+    def _unlink_idle(self):
+        for token in [token for token in self.retired if not self.in_flight.get(token)]:
+            self.retired.pop(token).unlink()
+            self.in_flight.pop(token, None)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        with self.lock:
+            for shared in list(self.retired.values()) + ([self.current] if self.current else []):
+                shared.unlink()
+            self.retired, self.current = {}, None
@@ -0,0 +1,94 @@
+import threading
+from collections import deque
+
+
+class WriteBehindBuffer:
+    """Collects items in memory and hands them to `write(batch)` from a background thread.
+
+    A batch is flushed once `max_batch` items are pending or `flush_interval` seconds have passed.
+    When `max_pending` items are already waiting, new items are dropped (and counted) instead of
+    blocking the caller. Items `validate` raises on are rejected (and counted as failed) up front,
+    so one bad item can't fail a whole batch.
+    """
+
+    def __init__(self, write, max_batch=100, flush_interval=1.0, max_pending=10000, name="write-behind",
+                 validate=None):
+        self.write = write
+        self.validate = validate
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.name = name
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()  # One batch in flight at a time, keeps insert order
+        self.closed = False
+        self.thread = None
+        self.counters = {"buffered": 0, "written": 0, "dropped": 0, "failed": 0, "flushes": 0}
+
+    def add(self, item):
+        """Queues an item; returns False if it was dropped or rejected."""
+        if self.validate is not None:
+            try:
+                self.validate(item)
+            except Exception as e:
+                with self.condition:
+                    self.counters["failed"] += 1
+                print(f"❌ {self.name}: rejected item: {e}")
+                return False
+
+        with self.condition:
+            if self.closed or len(self.pending) >= self.max_pending:
+                self.counters["dropped"] += 1
+                return False
+
+            self.pending.append(item)
+            self.counters["buffered"] += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.thread.start()
+            if len(self.pending) >= self.max_batch:
+                self.condition.notify()
+        return True
+
+    def flush(self):
+        """Writes everything pending, in batches of at most `max_batch`."""
+        with self.flush_lock:
+            while True:
+                with self.condition:
+                    batch = [self.pending.popleft() for _ in range(min(self.max_batch, len(self.pending)))]
+                if not batch:
+                    return
+
+                try:
+                    self.write(batch)
+                    outcome = "written"
+                except Exception as e:
+                    outcome = "failed"
+                    print(f"❌ {self.name}: failed to write {len(batch)} items: {e}")
+
+                with self.condition:
+                    self.counters[outcome] += len(batch)
+                    self.counters["flushes"] += 1
+
+    def close(self, timeout=5.0):
+        """Stops the background thread and flushes what is left (call on shutdown)."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self.condition:
+            return dict(self.counters, pending=len(self.pending))
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.closed and len(self.pending) < self.max_batch:
+                    self.condition.wait(self.flush_interval)
+                if self.closed:
+                    return  # `close()` flushes the remainder
+            self.flush()